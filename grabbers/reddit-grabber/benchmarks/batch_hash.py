@@ -0,0 +1,61 @@
+"""
+Throughput of per-image imagehash.phash against batch_phash for a few batch
+sizes, on images already decoded at the hashing resolution. Also checks that
+both produce the same hashes.
+
+    poetry run python benchmarks/batch_hash.py [--images 2000]
+"""
+
+import argparse
+import random
+import time
+
+import imagehash
+from PIL import Image, ImageDraw
+
+from reddit_grabber.hashing import batch_phash
+
+batch_sizes = [1, 4, 16, 64, 256]
+
+
+def make_image(seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    size = (rng.randrange(128, 256), rng.randrange(128, 256))
+    im = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(10):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse(
+            [x, y, x + rng.randrange(size[0]), y + rng.randrange(size[1])],
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+    return im
+
+
+def run() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=2000)
+    args = parser.parse_args()
+
+    images = [make_image(i) for i in range(args.images)]
+
+    start = time.perf_counter()
+    expected = [imagehash.phash(im) for im in images]
+    elapsed = time.perf_counter() - start
+    print(f"{'imagehash.phash':>16} | {args.images / elapsed:>8.0f} images/s")
+
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        hashes = []
+        for i in range(0, len(images), batch_size):
+            hashes.extend(batch_phash(images[i : i + batch_size]))
+        elapsed = time.perf_counter() - start
+
+        assert hashes == expected, "batch_phash differs from imagehash.phash"
+        print(
+            f"{f'batch of {batch_size}':>16} | {args.images / elapsed:>8.0f} images/s"
+        )
+
+
+if __name__ == "__main__":
+    run()
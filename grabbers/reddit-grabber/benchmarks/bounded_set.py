@@ -0,0 +1,96 @@
+"""
+Add/lookup cost and memory footprint of BoundedSet against the list-backed
+history it replaced and an OrderedDict-backed alternative. Memory is the
+overhead of the container itself, the stored strings aren't counted.
+
+    poetry run python benchmarks/bounded_set.py
+"""
+
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from reddit_grabber.utils import BoundedSet
+
+sizes = [1_000, 100_000, 1_000_000]
+
+
+class ListHistory(list):
+    # The former FiniteList, with its capacity actually honoured
+    def __init__(self, max_len: int):
+        super().__init__()
+        self.max_len = max_len
+
+    def add(self, item):
+        if item in self:
+            return
+        list.append(self, item)
+        if len(self) > self.max_len:
+            del self[0]
+
+
+class OrderedDictHistory:
+    def __init__(self, max_len: int):
+        self.max_len = max_len
+        self._items = OrderedDict()
+
+    def __contains__(self, item) -> bool:
+        return item in self._items
+
+    def add(self, item):
+        if item in self._items:
+            return
+        self._items[item] = None
+        if len(self._items) > self.max_len:
+            self._items.popitem(last=False)
+
+
+def fullnames(start: int, count: int):
+    return [f"t3_{i:x}" for i in range(start, start + count)]
+
+
+def measure(cls, size: int, operations: int):
+    items = fullnames(0, size)
+    extra = fullnames(size, operations)
+
+    tracemalloc.start()
+    history = cls(size)
+    for item in items:
+        history.add(item)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Steady state: every add evicts the oldest item
+    start = time.perf_counter()
+    for item in extra:
+        history.add(item)
+    add_time = (time.perf_counter() - start) / operations * 1e6
+
+    start = time.perf_counter()
+    for item in items[-operations:]:
+        _ = item in history
+    lookup_time = (time.perf_counter() - start) / operations * 1e6
+
+    return add_time, lookup_time, memory
+
+
+def run() -> None:
+    print(
+        f"{'structure':>20} {'entries':>9} | {'add us':>8} {'lookup us':>9} | {'memory MB':>9}"
+    )
+    for size in sizes:
+        for cls in (ListHistory, OrderedDictHistory, BoundedSet):
+            # The list is O(n) per operation, a few of them are enough
+            operations = min(size, 200 if cls is ListHistory else 100_000)
+            if cls is ListHistory and size > 100_000:
+                print(f"{cls.__name__:>20} {size:>9} | {'(too slow)':>19} |")
+                continue
+            add_time, lookup_time, memory = measure(cls, size, operations)
+            print(
+                f"{cls.__name__:>20} {size:>9} | {add_time:>8.2f} {lookup_time:>9.2f} "
+                f"| {memory / 2 ** 20:>9.1f}"
+            )
+
+
+if __name__ == "__main__":
+    run()
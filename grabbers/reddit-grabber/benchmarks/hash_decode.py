@@ -0,0 +1,143 @@
+"""
+Decode time and peak memory of the full-resolution and the reduced-resolution
+phash paths.
+
+    poetry run python benchmarks/hash_decode.py [--decode-size 128] [--runs 5]
+
+Peak memory is measured as the growth of the max RSS of a fresh interpreter
+while it decodes and hashes a single image, so Pillow's own allocations are
+included.
+"""
+
+import argparse
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from reddit_grabber.utils import get_hash, open_image, get_content_hash
+
+sizes = [(1280, 720), (1920, 1080), (3840, 2160)]
+formats = ["JPEG", "PNG", "WEBP"]
+
+
+def make_image(size, fmt: str) -> bytes:
+    width, height = size
+    rng = random.Random(width)
+    # Flat shapes on a flat background look more like a meme than noise does
+    im = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.ellipse(
+            [x, y, x + rng.randrange(width // 3), y + rng.randrange(height // 3)],
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+
+    buffer = BytesIO()
+    im.save(buffer, fmt, quality=90)
+    return buffer.getvalue()
+
+
+def hash_once(content: bytes, reduced: bool, decode_size: int) -> str:
+    if reduced:
+        return str(get_content_hash(content, decode_size))
+    return str(get_hash(open_image(content)))
+
+
+def max_rss_kb() -> int:
+    # ru_maxrss survives exec on Linux, so the child would report the parent's
+    # peak. VmHWM belongs to the current address space only.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure_memory(path: Path, reduced: bool, decode_size: int) -> int:
+    # A fresh process per measurement, the peak never goes down
+    out = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--memory-worker",
+            str(path),
+            "--decode-size",
+            str(decode_size),
+        ]
+        + (["--reduced"] if reduced else []),
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return int(out.stdout.strip())
+
+
+def memory_worker(path: str, reduced: bool, decode_size: int) -> None:
+    content = Path(path).read_bytes()
+    # Warm up imports and scipy's DCT on a tiny image
+    hash_once(make_image((64, 64), "PNG"), reduced, decode_size)
+    before = max_rss_kb()
+    hash_once(content, reduced, decode_size)
+    print(max_rss_kb() - before)
+
+
+def run(decode_size: int, runs: int) -> None:
+    print(
+        f"{'image':>18} {'bytes':>9} | {'full ms':>8} {'full MB':>8} | "
+        f"{'reduced ms':>10} {'reduced MB':>10} | {'speedup':>7} {'distance':>8}"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in formats:
+            for size in sizes:
+                content = make_image(size, fmt)
+                path = Path(tmp) / f"{size[0]}x{size[1]}.{fmt.lower()}"
+                path.write_bytes(content)
+
+                timings = {}
+                hashes = {}
+                for reduced in (False, True):
+                    start = time.perf_counter()
+                    for _ in range(runs):
+                        hashes[reduced] = hash_once(content, reduced, decode_size)
+                    timings[reduced] = (time.perf_counter() - start) / runs * 1000
+
+                memory = {
+                    reduced: measure_memory(path, reduced, decode_size) / 1024
+                    for reduced in (False, True)
+                }
+                distance = bin(int(hashes[False], 16) ^ int(hashes[True], 16)).count(
+                    "1"
+                )
+
+                print(
+                    f"{fmt + ' ' + path.stem:>18} {len(content):>9} | "
+                    f"{timings[False]:>8.1f} {memory[False]:>8.1f} | "
+                    f"{timings[True]:>10.1f} {memory[True]:>10.1f} | "
+                    f"{timings[False] / timings[True]:>6.1f}x {distance:>8}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--decode-size", type=int, default=128)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--memory-worker")
+    parser.add_argument("--reduced", action="store_true")
+    args = parser.parse_args()
+
+    if args.memory_worker:
+        memory_worker(args.memory_worker, args.reduced, args.decode_size)
+    else:
+        run(args.decode_size, args.runs)
@@ -0,0 +1,53 @@
+"""
+Query latency of the near-duplicate phash index.
+
+    poetry run python benchmarks/phash_index.py [--distance 6] [--size 1000000]
+"""
+
+import argparse
+import random
+import time
+
+from reddit_grabber.phash_index import PhashIndex
+
+
+def flip_bits(h: int, bits: int, rng: random.Random) -> int:
+    for position in rng.sample(range(64), bits):
+        h ^= 1 << position
+    return h
+
+
+def run(distance: int, size: int, queries: int) -> None:
+    rng = random.Random(42)
+    stored = [rng.getrandbits(64) for _ in range(size)]
+
+    index = PhashIndex(distance)
+    start = time.perf_counter()
+    for h in stored:
+        index.add(h)
+    print(f"built index of {len(index)} hashes in {time.perf_counter() - start:.1f}s")
+
+    near = [
+        flip_bits(rng.choice(stored), rng.randint(1, distance), rng)
+        for _ in range(queries)
+    ]
+    far = [rng.getrandbits(64) for _ in range(queries)]
+
+    for name, sample in (("near duplicates", near), ("new hashes", far)):
+        found = 0
+        start = time.perf_counter()
+        for h in sample:
+            if index.find(h, 0) is not None:
+                found += 1
+        elapsed = (time.perf_counter() - start) / len(sample) * 1000
+        print(f"{name:>16}: {elapsed:.3f} ms/query, {found}/{len(sample)} matched")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--distance", type=int, default=6)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    run(args.distance, args.size, args.queries)
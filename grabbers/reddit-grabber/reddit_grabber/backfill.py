@@ -0,0 +1,116 @@
+from typing import List, Optional
+
+import praw
+from praw.models import Subreddit
+from redis import StrictRedis
+
+from reddit_grabber import stats
+from reddit_grabber.listing import get_listing_page, time_filters
+from reddit_grabber.pipeline import Pipeline
+from reddit_grabber.stages import accept_submission
+from reddit_grabber.utils import GrabberConfiguration, get_current_utc_timestamp
+
+backfill_db = "gr_backfill"
+backfill_done = "done"
+# Reddit doesn't return more than that per request
+backfill_page_size = 100
+
+
+def backfill_time_filters(
+    since: float, until: Optional[float], now: float
+) -> List[str]:
+    """
+    Every `top` listing holds at most ~1000 posts, so all time filters that
+    overlap the range are paged: the widest one needed to reach `since` and the
+    narrower ones, which dig deeper into recent posts.
+    """
+    needed: List[str] = []
+    for name, span in time_filters:
+        if not until or now - span < until:
+            needed.append(name)
+        if now - span <= since:
+            break
+    return needed
+
+
+def checkpoint_field(
+    subreddit: str, conf: GrabberConfiguration, time_filter: Optional[str]
+) -> str:
+    to = int(conf.backfill_to) if conf.backfill_to else ""
+    listing = f"top:{time_filter}" if time_filter else "new"
+    return f"{subreddit.lower()}:{listing}:{int(conf.backfill_from)}-{to}"
+
+
+def backfill_listing(
+    connection: StrictRedis,
+    pipeline: Pipeline,
+    subreddit: Subreddit,
+    conf: GrabberConfiguration,
+    time_filter: Optional[str],
+) -> None:
+    """
+    Pages through one listing, feeding posts within the configured time range
+    to the pipeline. The fullname of the last page is checkpointed once all of
+    its posts went through the pipeline, so a restarted backfill goes on from
+    there.
+    """
+    field = checkpoint_field(subreddit.display_name, conf, time_filter)
+    checkpoint: Optional[bytes] = connection.hget(backfill_db, field)
+    if checkpoint == backfill_done.encode():
+        print(f"Backfill of {field} is already finished")
+        return
+
+    after = checkpoint.decode() if checkpoint else None
+    mode = "top" if time_filter else "new"
+    page = get_listing_page(subreddit, mode, backfill_page_size, after, time_filter)
+
+    while page:
+        reached_start = False
+        for sub in page:
+            if sub.created_utc < conf.backfill_from:
+                reached_start = True
+                continue
+            if conf.backfill_to and sub.created_utc >= conf.backfill_to:
+                continue
+
+            stats.increment("backfill_posts")
+            task = accept_submission(sub, conf)
+            if task:
+                pipeline.put(task)
+
+        after = page[-1].fullname
+        # `new` is sorted by time, nothing after the first old post is in range.
+        # The next page is requested while the pipeline is still busy.
+        if reached_start and mode == "new":
+            page = []
+        else:
+            page = get_listing_page(
+                subreddit, mode, backfill_page_size, after, time_filter
+            )
+
+        pipeline.join()
+        connection.hset(backfill_db, field, after if page else backfill_done)
+        print(f"Backfill of {field} reached {after}")
+
+    connection.hset(backfill_db, field, backfill_done)
+
+
+def run_backfill(
+    connection: StrictRedis,
+    reddit: praw.Reddit,
+    pipeline: Pipeline,
+    conf: GrabberConfiguration,
+) -> None:
+    now = get_current_utc_timestamp()
+    if conf.backfill_listing == "top":
+        filters: List[Optional[str]] = backfill_time_filters(
+            conf.backfill_from, conf.backfill_to, now
+        )
+    else:
+        filters = [None]
+
+    for name in conf.subreddit_name.split("+"):
+        for time_filter in filters:
+            backfill_listing(
+                connection, pipeline, reddit.subreddit(name), conf, time_filter
+            )
@@ -0,0 +1,113 @@
+import hashlib
+import math
+from typing import List
+
+from redis import StrictRedis
+
+# KEYS: partitions, the current one first. ARGV: bit offsets, then the expiration
+# time of the current partition. Returns 1 if the item was added, 0 if it was known.
+claim_script = """
+local hashes = #ARGV - 1
+for _, key in ipairs(KEYS) do
+    local known = true
+    for i = 1, hashes do
+        if redis.call('GETBIT', key, ARGV[i]) == 0 then
+            known = false
+            break
+        end
+    end
+    if known then
+        return 0
+    end
+end
+for i = 1, hashes do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+end
+redis.call('EXPIREAT', KEYS[1], ARGV[hashes + 1])
+return 1
+"""
+
+
+class RotatingBloomFilter:
+    """
+    Bloom filter kept in Redis bitmaps and partitioned by time.
+
+    Items are added to the partition of the current `partition_time` seconds
+    long period and looked up in the last `partitions` ones, so the filter
+    remembers items for `partition_time * partitions` seconds. Old partitions
+    simply expire. `error_rate` is the false positive rate of the whole filter
+    when every partition holds `capacity` items.
+    """
+
+    def __init__(
+        self,
+        connection: StrictRedis,
+        prefix: str,
+        capacity: int,
+        error_rate: float,
+        partition_time: int,
+        partitions: int,
+    ) -> None:
+        self.connection: StrictRedis = connection
+        self.prefix: str = prefix
+        self.partition_time: int = partition_time
+        self.partitions: int = max(1, partitions)
+
+        # An item is looked up in every partition, so each of them gets its share
+        partition_error_rate = error_rate / self.partitions
+        self.size: int = math.ceil(
+            -capacity * math.log(partition_error_rate) / math.log(2) ** 2
+        )
+        self.hashes: int = max(1, round(self.size / capacity * math.log(2)))
+        self._claim = connection.register_script(claim_script)
+
+    def offsets(self, item: str) -> List[int]:
+        # Kirsch-Mitzenmacher: two independent hashes are enough to simulate k
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def current_partition(self, now: float) -> int:
+        return int(now // self.partition_time)
+
+    def partition_key(self, partition: int) -> str:
+        return f"{self.prefix}:{partition}"
+
+    def partition_keys(self, now: float) -> List[str]:
+        current = self.current_partition(now)
+        return [self.partition_key(current - i) for i in range(self.partitions)]
+
+    def partition_expire_time(self, now: float) -> int:
+        return (self.current_partition(now) + self.partitions) * self.partition_time
+
+    def add(self, item: str, now: float) -> None:
+        key = self.partition_key(self.current_partition(now))
+
+        pipe = self.connection.pipeline(transaction=False)
+        for offset in self.offsets(item):
+            pipe.setbit(key, offset, 1)
+        pipe.expireat(key, self.partition_expire_time(now))
+        pipe.execute()
+
+    def contains(self, item: str, now: float) -> bool:
+        offsets = self.offsets(item)
+
+        pipe = self.connection.pipeline(transaction=False)
+        for key in self.partition_keys(now):
+            for offset in offsets:
+                pipe.getbit(key, offset)
+        bits = pipe.execute()
+
+        return any(
+            all(bits[i : i + self.hashes]) for i in range(0, len(bits), self.hashes)
+        )
+
+    def claim(self, item: str, now: float) -> bool:
+        # Atomic `contains` + `add`, True if the item wasn't known before
+        return bool(
+            self._claim(
+                keys=self.partition_keys(now),
+                args=self.offsets(item) + [self.partition_expire_time(now)],
+            )
+        )
@@ -0,0 +1,94 @@
+import time
+from typing import Optional
+
+from prawcore import Requestor
+from redis import StrictRedis
+
+from reddit_grabber import stats
+
+budget_prefix = "gr_budget"
+
+# Token bucket shared by all grabbers of one client id. Redis' clock is used, so
+# grabbers on different hosts agree on refills. Returns 0 if a token was taken,
+# otherwise the number of milliseconds to wait for the next one.
+take_token_script = """
+if redis.replicate_commands then redis.replicate_commands() end
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local max_rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate')
+local rate = tonumber(state[3]) or max_rate
+local tokens = burst
+if state[1] then
+    tokens = math.min(burst, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+end
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 3600)
+return wait
+"""
+
+
+class RequestBudget:
+    """
+    Reddit API request budget shared through Redis by every grabber that uses
+    the same client id. Tokens are refilled at up to `max_rate` requests per
+    second with bursts of `burst` requests. The refill rate follows Reddit's
+    `X-Ratelimit-*` headers: whatever is left of the quota is spread evenly over
+    the time until it resets.
+    """
+
+    def __init__(
+        self, connection: StrictRedis, client_id: str, max_rate: float, burst: int
+    ) -> None:
+        self.connection: StrictRedis = connection
+        self.key: str = f"{budget_prefix}:{client_id}"
+        self.max_rate: float = max_rate
+        self.burst: int = burst
+        self._take = connection.register_script(take_token_script)
+
+    def acquire(self) -> None:
+        while True:
+            wait = self._take(keys=[self.key], args=[self.max_rate, self.burst])
+            if not wait:
+                return
+            stats.increment("budget_waits")
+            time.sleep(wait / 1000)
+
+    def adapt(self, remaining: Optional[str], reset: Optional[str]) -> None:
+        if remaining is None or reset is None:
+            return
+
+        # A small floor keeps the bucket from stalling on a spent quota
+        rate = float(remaining) / max(1.0, float(reset))
+        rate = min(self.max_rate, max(rate, 0.01))
+        self.connection.hset(self.key, "rate", rate)
+
+
+class BudgetedRequestor(Requestor):
+    """
+    prawcore requestor that takes a token from the shared budget before every
+    API call and feeds the rate limit headers of the response back to it.
+    """
+
+    def __init__(self, *args, budget: RequestBudget, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.budget: RequestBudget = budget
+
+    def request(self, *args, **kwargs):
+        self.budget.acquire()
+        response = super().request(*args, **kwargs)
+        self.budget.adapt(
+            response.headers.get("x-ratelimit-remaining"),
+            response.headers.get("x-ratelimit-reset"),
+        )
+        return response
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable, Optional, Tuple
+
+from reddit_grabber import stats
+
+
+class DedupeCache:
+    """
+    Bounded LRU of "was it already processed" answers.
+
+    Positive answers live until their Redis entry expires, negative ones only for
+    `miss_ttl` seconds, since another grabber may register the same key at any
+    moment. Hits and misses are counted in `stats` under `name`.
+    """
+
+    def __init__(self, name: str, max_len: int, miss_ttl: float) -> None:
+        self.name: str = name
+        self.max_len: int = max_len
+        self.miss_ttl: float = miss_ttl
+        self._entries: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, now: float) -> Optional[bool]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                processed, expire = entry
+                if expire > now:
+                    self._entries.move_to_end(key)
+                    stats.increment(f"{self.name}_hits")
+                    return processed
+                del self._entries[key]
+
+        stats.increment(f"{self.name}_misses")
+        return None
+
+    def put(self, key: str, processed: bool, expire: float) -> None:
+        with self._lock:
+            self._entries[key] = (processed, expire)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_len:
+                self._entries.popitem(last=False)
+
+    def discard(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def put_processed(self, key: str, expire: float) -> None:
+        self.put(key, True, expire)
+
+    def put_unprocessed(self, key: str, now: float) -> None:
+        self.put(key, False, now + self.miss_ttl)
@@ -0,0 +1,126 @@
+from functools import partial
+from threading import Lock
+from typing import Callable, Optional, Set
+
+from praw.reddit import Submission
+from redis import StrictRedis
+
+from reddit_grabber import stats
+from reddit_grabber.utils import get_current_utc_timestamp
+
+cursors_prefix = "gr_cursors"
+# Cursors of streams nobody consumes anymore (e.g. past shard assignments) go away
+cursor_ttl = 7 * 24 * 3600
+
+# Moves the cursor forward only, so grabbers consuming the same stream can't
+# undo each other's progress. Ids are base 36.
+advance_cursor_script = """
+local current = redis.call('GET', KEYS[1])
+if not current or tonumber(current, 36) < tonumber(ARGV[1], 36) then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def submission_number(submission_id: str) -> int:
+    return int(submission_id, 36)
+
+
+def submission_id(number: int) -> str:
+    result = ""
+    while True:
+        number, digit = divmod(number, 36)
+        result = digits[digit] + result
+        if not number:
+            return result
+
+
+def stream_name(subreddits: str) -> str:
+    # The same multireddit can be spelled in any order and case
+    return "+".join(sorted(s.lower() for s in subreddits.split("+") if s))
+
+
+class StreamCursor:
+    """
+    Checkpoint of the stream being consumed, stored in `gr_cursors:{stream}`.
+    praw replays up to 100 old submissions whenever a stream starts, and those
+    at or below the checkpoint are skipped without any lookups. Submission ids
+    are global, so a single cursor covers a stream of several subreddits (`all`
+    included).
+
+    Submissions leave the pipeline out of order, so the checkpoint is the newest
+    submission with nothing older still in flight: a crash replays what wasn't
+    processed yet instead of losing it. It is written at most once per
+    `interval` seconds.
+    """
+
+    def __init__(self, connection: StrictRedis, interval: int) -> None:
+        self.connection: StrictRedis = connection
+        self.interval: int = interval
+        self.key: Optional[str] = None
+        # Newest submission streamed so far
+        self.cursor: Optional[int] = None
+        self._saved: Optional[int] = None
+        self._in_flight: Set[int] = set()
+        self._lock: Lock = Lock()
+        self._last_flush: float = get_current_utc_timestamp()
+        self._advance = connection.register_script(advance_cursor_script)
+
+    def load(self, subreddits: str) -> None:
+        with self._lock:
+            self.key = f"{cursors_prefix}:{stream_name(subreddits)}"
+            value = self.connection.get(self.key)
+            self.cursor = submission_number(value.decode()) if value else None
+            self._saved = self.cursor
+            self._in_flight = set()
+
+    def is_new(self, submission: Submission) -> bool:
+        number = submission_number(submission.id)
+        if self.cursor is not None and number <= self.cursor:
+            stats.increment("cursor_skipped")
+            return False
+        return True
+
+    def advance(self, submission: Submission) -> Callable[[], None]:
+        """
+        Moves past a streamed submission. The checkpoint doesn't cover it until
+        the returned callback reports that it was processed.
+        """
+        number = submission_number(submission.id)
+        with self._lock:
+            if self.cursor is None or number > self.cursor:
+                self.cursor = number
+            self._in_flight.add(number)
+            return partial(self._processed, self.key, number)
+
+    def _processed(self, key: Optional[str], number: int) -> None:
+        with self._lock:
+            # Submissions of a previous stream have nothing to do with this one
+            if key == self.key:
+                self._in_flight.discard(number)
+
+    def checkpoint(self) -> Optional[int]:
+        with self._lock:
+            if self._in_flight:
+                return min(self._in_flight) - 1
+            return self.cursor
+
+    def flush(self, force: bool = False) -> None:
+        current_time = get_current_utc_timestamp()
+        checkpoint = self.checkpoint()
+        if self.key is None or checkpoint is None:
+            return
+        if self._saved is not None and checkpoint <= self._saved:
+            return
+        if not force and current_time < self._last_flush + self.interval:
+            return
+
+        self._advance(keys=[self.key], args=[submission_id(checkpoint), cursor_ttl])
+
+        self._saved = checkpoint
+        self._last_flush = current_time
@@ -3,7 +3,11 @@ from typing import List, Optional, Dict
 
 from praw.reddit import Submission
 
-from reddit_grabber.utils import get_current_utc_timestamp, GrabberConfiguration
+from reddit_grabber.utils import (
+    get_current_utc_timestamp,
+    GrabberConfiguration,
+    listing_value,
+)
 
 
 class GotRedditEvent:
@@ -20,6 +24,7 @@ class GotRedditEvent:
         author: str,
         is_original_content: bool,
         shortlink: str,
+        digest: Optional[str] = None,
     ) -> None:
         self.tags: List[str] = tags
         self.url: str = url
@@ -33,7 +38,8 @@ class GotRedditEvent:
         self.shortlink: str = shortlink
         self.over_18: bool = over_18
         self.is_original_content: bool = is_original_content
-        self.version = "1.1"
+        self.digest: Optional[str] = digest
+        self.version = "1.2"
 
     def as_dict(self) -> Dict:
         base_dict = {
@@ -51,6 +57,7 @@ class GotRedditEvent:
             "shortlink": self.shortlink,
             "over_18": self.over_18,
             "is_original_content": self.is_original_content,
+            "digest": self.digest,
         }
 
         return base_dict
@@ -58,27 +65,34 @@ class GotRedditEvent:
     def as_json(self) -> str:
         return json.dumps(self.as_dict(), separators=(",", ":"))
 
-    @staticmethod
+    @classmethod
     def from_submission(
-        sub: Submission, conf: GrabberConfiguration
+        cls,
+        sub: Submission,
+        conf: GrabberConfiguration,
+        digest: Optional[str] = None,
+        url: Optional[str] = None,
     ) -> "GotRedditEvent":
+        """
+        Builds the event from the listing payload alone, so no submission is
+        fetched again from the API. `url` replaces the submission's one for
+        gallery items.
+        """
         tags: List[str] = conf.tags
-        url: str = sub.url if hasattr(sub, "url") else None
-        ups: Optional[int] = sub.ups if hasattr(sub, "ups") else None
-        downs: Optional[int] = sub.downs if hasattr(sub, "downs") else None
+        url: str = url if url else listing_value(sub, "url")
+        ups: Optional[int] = listing_value(sub, "ups")
+        downs: Optional[int] = listing_value(sub, "downs")
         source: str = conf.service_id
-        subreddit_name_prefixed: str = sub.subreddit_name_prefixed if hasattr(
-            sub, "subreddit_name_prefixed"
-        ) else None
-        title: str = sub.title if hasattr(sub, "title") else None
-        author: str = str(sub.author) if hasattr(sub, "author") else None
-        shortlink: str = sub.shortlink if hasattr(sub, "shortlink") else None
-        over_18: bool = sub.over_18 if hasattr(sub, "over_18") else False
-        is_original_content: bool = sub.is_original_content if hasattr(
-            sub, "is_original_content"
-        ) else False
+        subreddit_name_prefixed: str = listing_value(sub, "subreddit_name_prefixed")
+        title: str = listing_value(sub, "title")
+        author = listing_value(sub, "author")
+        author: str = str(author) if author is not None else None
+        # A property built from the id rather than a listing attribute
+        shortlink: str = sub.shortlink if listing_value(sub, "id") else None
+        over_18: bool = listing_value(sub, "over_18", False)
+        is_original_content: bool = listing_value(sub, "is_original_content", False)
 
-        return GotRedditEvent(
+        return cls(
             tags=tags,
             url=url,
             ups=ups,
@@ -90,4 +104,24 @@ class GotRedditEvent:
             author=author,
             is_original_content=is_original_content,
             shortlink=shortlink,
+            digest=digest,
         )
+
+
+class GotRedditGalleryEvent(GotRedditEvent):
+    """
+    All published items of a gallery post. `url` and `digest` are those of the
+    first item, so consumers unaware of galleries still get one image.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.e_type = "Got_Reddit_Gallery"
+        self.urls: List[str] = [self.url]
+        self.digests: List[Optional[str]] = [self.digest]
+
+    def as_dict(self) -> Dict:
+        base_dict = super().as_dict()
+        base_dict["urls"] = self.urls
+        base_dict["digests"] = self.digests
+        return base_dict
@@ -1,3 +1,8 @@
 class RedditGrabberException(Exception):
     def __init__(self, mess: str):
         super().__init__(mess)
+
+
+class FetchException(RedditGrabberException):
+    def __init__(self, mess: str):
+        super().__init__(mess)
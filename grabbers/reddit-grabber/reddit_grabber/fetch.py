@@ -0,0 +1,125 @@
+import time
+from io import BytesIO
+from threading import BoundedSemaphore, Lock
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from reddit_grabber.exceptions import FetchException
+from reddit_grabber.utils import GrabberConfiguration
+
+chunk_size = 64 * 1024
+
+
+def check_image_size(content: bytes, max_pixels: Optional[int]) -> None:
+    # Image.open only parses the header, so the pixel budget is checked
+    # before anything is decoded
+    try:
+        with Image.open(BytesIO(content)) as im:
+            width, height = im.size
+    except (Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        raise FetchException(f"Unreadable image: {e}")
+
+    if max_pixels and width * height > max_pixels:
+        raise FetchException(
+            f"Image is too large: {width}x{height} exceeds {max_pixels} pixels"
+        )
+
+
+class FetchClient:
+    def __init__(
+        self,
+        pool_size: int,
+        host_concurrency: int,
+        connect_timeout: float,
+        read_timeout: float,
+        max_time: float,
+        max_bytes: Optional[int],
+        max_pixels: Optional[int],
+        user_agent: Optional[str] = None,
+    ) -> None:
+        self.host_concurrency: int = max(1, host_concurrency)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_time: float = max_time
+        self.max_bytes: Optional[int] = max_bytes
+        self.max_pixels: Optional[int] = max_pixels
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+
+        self._hosts: Dict[str, BoundedSemaphore] = {}
+        self._hosts_lock = Lock()
+
+    @staticmethod
+    def from_configuration(conf: GrabberConfiguration) -> "FetchClient":
+        return FetchClient(
+            pool_size=conf.fetch_pool_size,
+            host_concurrency=conf.fetch_host_concurrency,
+            connect_timeout=conf.fetch_connect_timeout,
+            read_timeout=conf.fetch_read_timeout,
+            max_time=conf.fetch_max_time,
+            max_bytes=conf.fetch_max_bytes,
+            max_pixels=conf.fetch_max_pixels,
+            user_agent=conf.user_agent,
+        )
+
+    def _host_semaphore(self, url: str) -> BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = BoundedSemaphore(self.host_concurrency)
+            return self._hosts[host]
+
+    def _read(self, url: str) -> bytes:
+        deadline = time.monotonic() + self.max_time
+
+        with self.session.get(
+            url, allow_redirects=True, stream=True, timeout=self.timeout
+        ) as r:
+            r.raise_for_status()
+
+            length = r.headers.get("Content-Length")
+            if self.max_bytes and length and length.isdigit():
+                if int(length) > self.max_bytes:
+                    raise FetchException(
+                        f"{url} is too large: {length} bytes exceeds {self.max_bytes}"
+                    )
+
+            buffer = bytearray()
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                buffer.extend(chunk)
+                if self.max_bytes and len(buffer) > self.max_bytes:
+                    raise FetchException(
+                        f"{url} is too large: body exceeds {self.max_bytes} bytes"
+                    )
+                if time.monotonic() > deadline:
+                    raise FetchException(
+                        f"{url} took longer than {self.max_time} seconds to download"
+                    )
+
+        return bytes(buffer)
+
+    def fetch(self, url: str) -> bytes:
+        if not url:
+            raise FetchException("There is no url to fetch")
+
+        try:
+            with self._host_semaphore(url):
+                return self._read(url)
+        except requests.RequestException as e:
+            raise FetchException(f"Unable to fetch {url}: {e}")
+
+    def fetch_image(self, url: str) -> bytes:
+        content = self.fetch(url)
+        check_image_size(content, self.max_pixels)
+        return content
+
+    def close(self) -> None:
+        self.session.close()
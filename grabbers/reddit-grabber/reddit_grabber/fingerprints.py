@@ -0,0 +1,59 @@
+import os
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from praw.reddit import Submission
+
+from reddit_grabber.utils import listing_value
+
+# Hosts where the file name is Reddit's own id of the uploaded media
+media_hosts = ("i.redd.it", "preview.redd.it")
+
+
+def media_id(url: Optional[str]) -> Optional[str]:
+    if not url:
+        return None
+
+    parsed = urlparse(url)
+    if parsed.hostname not in media_hosts:
+        return None
+
+    return os.path.splitext(os.path.basename(parsed.path))[0] or None
+
+
+def submission_fingerprints(submission: Submission) -> List[str]:
+    """
+    Identifiers of the submission's image that are known without downloading
+    it: the post itself, the id of the uploaded media and the id Reddit gave to
+    its preview. Crossposts and link reposts share at least one of them with
+    the original.
+    """
+    fingerprints: List[str] = []
+
+    submission_id = listing_value(submission, "id")
+    if submission_id:
+        fingerprints.append(f"post:t3_{submission_id}")
+
+    media = media_id(listing_value(submission, "url"))
+    if media:
+        fingerprints.append(f"media:{media}")
+
+    preview = listing_value(submission, "preview")
+    if preview and preview.get("images") and preview["images"][0].get("id"):
+        fingerprints.append(f"preview:{preview['images'][0]['id']}")
+
+    return fingerprints
+
+
+def lookup_fingerprints(submission: Submission) -> List[str]:
+    """
+    Fingerprints that mark the submission as a repost when already registered.
+    A crosspost is also matched by the post it was crossposted from.
+    """
+    fingerprints = submission_fingerprints(submission)
+
+    parent = listing_value(submission, "crosspost_parent")
+    if parent:
+        fingerprints.append(f"post:{parent}")
+
+    return fingerprints
@@ -0,0 +1,91 @@
+import html
+from threading import Lock
+from typing import Dict, List, Optional, Set, Tuple
+
+from praw.reddit import Submission
+
+from reddit_grabber.utils import listing_value, pick_rendition
+
+# Gallery items only come with a mime type, originals live on i.redd.it
+extensions = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp"}
+
+
+def is_gallery(submission: Submission) -> bool:
+    # Crossposted galleries keep their media in the parent post
+    return bool(
+        listing_value(submission, "is_gallery")
+        and listing_value(submission, "gallery_data")
+        and listing_value(submission, "media_metadata")
+    )
+
+
+def rendition(entry: Dict) -> Dict:
+    # media_metadata renditions name their sides x and y
+    return {
+        "url": entry.get("u"),
+        "width": entry.get("x", 0),
+        "height": entry.get("y", 0),
+    }
+
+
+def gallery_items(
+    submission: Submission, min_size: int
+) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Media id, original url and preview url (see `get_preview_url`) of every
+    still image of the gallery, in gallery order. Animated and unprocessed
+    items are left out.
+    """
+    metadata = listing_value(submission, "media_metadata", {})
+    items: List[Tuple[str, str, Optional[str]]] = []
+
+    for item in listing_value(submission, "gallery_data", {}).get("items", []):
+        media = item.get("media_id")
+        meta = metadata.get(media) or {}
+        extension = extensions.get(meta.get("m"))
+        valid = meta.get("status") == "valid" and meta.get("e") == "Image"
+        if not valid or not extension:
+            continue
+
+        preview_url = None
+        if min_size:
+            renditions = [rendition(r) for r in meta.get("p", [])]
+            if meta.get("s"):
+                renditions.append(rendition(meta["s"]))
+            chosen = pick_rendition(renditions, min_size)
+            # Preview urls come HTML-escaped (&amp;) and are rejected as is
+            preview_url = html.unescape(chosen["url"]) if chosen else None
+
+        items.append((media, f"https://i.redd.it/{media}.{extension}", preview_url))
+
+    return items
+
+
+class GalleryGroup:
+    """
+    Outcome of the items of one gallery, which go through the pipeline
+    independently. Every item reports whether it was published, and the
+    report of the last one returns the published items, in gallery order.
+    Repeated reports of an item are ignored, so failure handlers can report
+    every item they may have lost.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size: int = size
+        self._reported: Set[int] = set()
+        self._published: Dict[int, Tuple[str, Optional[str]]] = {}
+        self._lock: Lock = Lock()
+
+    def done(
+        self, index: int, url: Optional[str] = None, digest: Optional[str] = None
+    ) -> Optional[List[Tuple[str, Optional[str]]]]:
+        with self._lock:
+            if index in self._reported:
+                return None
+            self._reported.add(index)
+            if url is not None:
+                self._published[index] = (url, digest)
+            if len(self._reported) < self.size:
+                return None
+
+        return [self._published[i] for i in sorted(self._published)]
@@ -0,0 +1,116 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import List, Optional
+
+import imagehash
+import numpy
+import scipy.fftpack
+from PIL import Image
+
+from reddit_grabber.utils import open_image_for_hash
+
+hash_size = 8
+highfreq_factor = 4
+img_size = hash_size * highfreq_factor
+
+
+def phash_pixels(im: Image.Image) -> numpy.ndarray:
+    # Same preprocessing as imagehash.phash (ANTIALIAS is LANCZOS)
+    return numpy.asarray(im.convert("L").resize((img_size, img_size), Image.LANCZOS))
+
+
+def batch_phash_pixels(pixels: List[numpy.ndarray]) -> List[imagehash.ImageHash]:
+    """
+    Hashes the output of `phash_pixels` for a whole batch at once: the DCTs,
+    medians and comparisons are done in single NumPy calls.
+    """
+    if not pixels:
+        return []
+
+    stacked = numpy.stack(pixels)
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(stacked, axis=1), axis=2)
+    low_frequencies = dct[:, :hash_size, :hash_size]
+    medians = numpy.median(low_frequencies.reshape(len(pixels), -1), axis=1)
+    diffs = low_frequencies > medians[:, None, None]
+
+    return [imagehash.ImageHash(diff) for diff in diffs]
+
+
+def batch_phash(images: List[Image.Image]) -> List[imagehash.ImageHash]:
+    """
+    Bit-identical to `[imagehash.phash(im) for im in images]`.
+    """
+    return batch_phash_pixels([phash_pixels(im) for im in images])
+
+
+def hash_contents(contents: List[bytes], decode_size: int) -> List[Optional[str]]:
+    """
+    Decodes and hashes compressed images. Images that fail to decode get `None`
+    instead of breaking the whole batch.
+    """
+    pixels = []
+    decoded = []
+    for i, content in enumerate(contents):
+        try:
+            pixels.append(phash_pixels(open_image_for_hash(content, decode_size)))
+            decoded.append(i)
+        except (OSError, SyntaxError, ValueError):
+            pass
+
+    hashes: List[Optional[str]] = [None] * len(contents)
+    for i, phash in zip(decoded, batch_phash_pixels(pixels)):
+        hashes[i] = str(phash)
+    return hashes
+
+
+class HashProcessPool:
+    """
+    Runs `hash_contents` in worker processes, so decoding and hashing aren't
+    limited by the GIL. Only compressed bytes are sent to the workers and only
+    hashes come back.
+
+    Workers are replaced after `max_tasks` batches each to give back the memory
+    Pillow accumulates. `max_tasks_per_child` needs Python 3.11, so the whole
+    executor is swapped instead: new batches go to a fresh one while the old one
+    finishes its batches and exits.
+    """
+
+    def __init__(self, processes: int, max_tasks: int) -> None:
+        self.processes: int = max(1, processes)
+        self.max_tasks: int = max_tasks
+        # Forking a process with live redis and praw threads isn't safe
+        self._context = multiprocessing.get_context("spawn")
+        self._lock: Lock = Lock()
+        self._tasks: int = 0
+        self._executor: ProcessPoolExecutor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(self.processes, mp_context=self._context)
+
+    def _recycle(self) -> None:
+        old, self._executor = self._executor, self._new_executor()
+        self._tasks = 0
+        old.shutdown(wait=False)
+
+    def hash(self, contents: List[bytes], decode_size: int) -> List[Optional[str]]:
+        with self._lock:
+            if self.max_tasks and self._tasks >= self.max_tasks * self.processes:
+                self._recycle()
+            self._tasks += 1
+            executor = self._executor
+            future = executor.submit(hash_contents, contents, decode_size)
+
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer), start over
+            with self._lock:
+                if self._executor is executor:
+                    self._recycle()
+            raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._executor.shutdown()
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+from typing import List, Tuple
+
+from PIL import Image
+
+# Telegram rejects photos above these limits instead of scaling them down
+telegram_max_bytes = 10 * 1024 * 1024
+telegram_max_dimensions = 10000
+telegram_max_ratio = 20
+
+
+def get_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def fits_telegram(content: bytes, im: Image.Image) -> bool:
+    width, height = im.size
+    return (
+        len(content) <= telegram_max_bytes
+        and width + height <= telegram_max_dimensions
+        and max(width, height) <= telegram_max_ratio * min(width, height)
+        and im.format in ("JPEG", "PNG", "WEBP")
+    )
+
+
+def normalize_for_telegram(content: bytes) -> bytes:
+    """
+    Returns `content` untouched when Telegram accepts it as a photo, otherwise
+    a JPEG scaled down to fit the limits. Too elongated images are cropped.
+    """
+    im = Image.open(BytesIO(content))
+    if fits_telegram(content, im):
+        return content
+
+    width, height = im.size
+    if width > telegram_max_ratio * height:
+        im = im.crop((0, 0, telegram_max_ratio * height, height))
+    elif height > telegram_max_ratio * width:
+        im = im.crop((0, 0, width, telegram_max_ratio * width))
+
+    im = im.convert("RGB")
+    scale = min(1.0, (telegram_max_dimensions - 1) / sum(im.size))
+    quality = 90
+    while True:
+        size = (max(1, int(im.width * scale)), max(1, int(im.height * scale)))
+        buffer = BytesIO()
+        im.resize(size, Image.LANCZOS).save(buffer, "JPEG", quality=quality)
+        if buffer.tell() <= telegram_max_bytes:
+            return buffer.getvalue()
+        scale *= 0.75
+
+
+class ImageStore:
+    """
+    Content-addressed image directory shared with voters and publishers.
+
+    Images are stored under `{root}/{digest[:2]}/{digest}`. Readers bump the
+    mtime of the images they send, so the mtime is the last use time and the
+    store keeps under `max_bytes` by removing the least recently used images.
+    Only the grabber writes and evicts.
+    """
+
+    def __init__(self, root: str, max_bytes: int) -> None:
+        self.root: Path = Path(root)
+        self.max_bytes: int = max_bytes
+        self._lock: Lock = Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.size: int = sum(size for _, _, size in self._entries())
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _entries(self) -> List[Tuple[float, Path, int]]:
+        entries = []
+        for directory in self.root.iterdir():
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.is_file() and not entry.name.startswith("."):
+                    entries.append((st.st_mtime, Path(entry.path), st.st_size))
+        return entries
+
+    def put(self, content: bytes) -> str:
+        """
+        Stores normalized `content` and returns its digest. Storing the same
+        image again only marks it as recently used.
+        """
+        content = normalize_for_telegram(content)
+        digest = get_digest(content)
+        path = self.path(digest)
+
+        if path.exists():
+            path.touch()
+            return digest
+
+        path.parent.mkdir(exist_ok=True)
+        # Readers must never see a partially written image
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self.size += len(content)
+            if self.size > self.max_bytes:
+                self._evict()
+
+        return digest
+
+    def _evict(self) -> None:
+        # Going down to 90% means the directory isn't rescanned on every put
+        entries = sorted(self._entries())
+        self.size = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+
+        for _, path, size in entries:
+            if self.size <= target:
+                break
+            try:
+                path.unlink()
+                self.size -= size
+            except FileNotFoundError:
+                pass
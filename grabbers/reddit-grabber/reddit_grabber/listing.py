@@ -0,0 +1,88 @@
+import math
+from typing import Callable, Iterator, List, Optional
+
+from praw.models import Subreddit
+from praw.reddit import Submission
+
+from reddit_grabber import stats
+from reddit_grabber.exceptions import RedditGrabberException
+from reddit_grabber.utils import BoundedSet
+
+# Spans of the `top` listing time filters, widest last
+time_filters = [
+    ("hour", 3600),
+    ("day", 86400),
+    ("week", 7 * 86400),
+    ("month", 31 * 86400),
+    ("year", 366 * 86400),
+    ("all", math.inf),
+]
+
+
+def get_listing_page(
+    subreddit: Subreddit,
+    mode: str,
+    limit: int,
+    after: Optional[str],
+    time_filter: str = "all",
+) -> List[Submission]:
+    params = {"after": after} if after else None
+
+    if mode == "hot":
+        listing = subreddit.hot(limit=limit, params=params)
+    elif mode == "rising":
+        listing = subreddit.rising(limit=limit, params=params)
+    elif mode == "new":
+        listing = subreddit.new(limit=limit, params=params)
+    elif mode == "top":
+        listing = subreddit.top(time_filter=time_filter, limit=limit, params=params)
+    else:
+        raise RedditGrabberException(
+            f"Critical error. Mode {mode} can't be used for listing"
+        )
+
+    stats.increment("listing_requests")
+    return list(listing)
+
+
+def fetch_new_submissions(
+    subreddit: Subreddit,
+    mode: str,
+    window: int,
+    page_size: int,
+    seen_posts: BoundedSet,
+    observe: Optional[Callable[[Submission], None]] = None,
+) -> Iterator[Submission]:
+    """
+    Re-issues the listing page by page, following the fullname of the last post as
+    a cursor, and yields only posts missing from `seen_posts`. Paging stops at the
+    end of the window or at the first page made only of already seen posts, so a
+    quiet subreddit costs a single request per cycle.
+
+    `observe` is called with every listed post, old ones included, e.g. to
+    follow their upvotes.
+    """
+    after: Optional[str] = None
+    fetched = 0
+
+    while fetched < window:
+        page = get_listing_page(
+            subreddit, mode, min(page_size, window - fetched), after
+        )
+        if not page:
+            return
+
+        if observe is not None:
+            for sub in page:
+                observe(sub)
+
+        new_posts = [sub for sub in page if sub.fullname not in seen_posts]
+        for sub in new_posts:
+            seen_posts.add(sub.fullname)
+            yield sub
+
+        if not new_posts:
+            return
+
+        fetched += len(page)
+        after = page[-1].fullname
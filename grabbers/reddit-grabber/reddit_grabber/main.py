@@ -1,95 +1,209 @@
 import time
-from concurrent.futures.thread import ThreadPoolExecutor
+from threading import Thread
+from typing import Callable, Set, Optional, Iterator
 
 import praw
 from praw.reddit import Submission
 
-from reddit_grabber.events import GotRedditEvent
-from reddit_grabber.exceptions import RedditGrabberException
-from reddit_grabber.redis_utils import (
-    register_submission,
-    connect_to_redis,
-    publish_submission,
-    url_was_already_processed,
-    phash_was_already_processed,
+from reddit_grabber import redis_utils
+from reddit_grabber.backfill import run_backfill
+from reddit_grabber.budget import RequestBudget, BudgetedRequestor
+from reddit_grabber.cursors import StreamCursor
+from reddit_grabber.listing import fetch_new_submissions
+from reddit_grabber.pipeline import Pipeline
+from reddit_grabber.ranking import VelocityRanker
+from reddit_grabber.redis_utils import connect_to_redis, publish_stats
+from reddit_grabber.sharding import ShardCoordinator, heartbeat_loop
+from reddit_grabber.stages import (
+    accept_submission,
+    build_pipeline,
+    is_known,
+    when_processed,
 )
 from reddit_grabber.utils import (
-    is_image,
-    get_hash,
-    get_image,
     GrabberConfiguration,
     get_configuration,
-    FiniteList,
+    BoundedSet,
     get_current_utc_timestamp,
 )
 
 
-def process_submission(submission: Submission, conf: GrabberConfiguration) -> None:
-    if not is_image(submission):
-        return
+def connect_to_reddit(conf: GrabberConfiguration) -> praw.Reddit:
+    if not conf.api_budget:
+        return praw.Reddit(
+            client_id=conf.client_id,
+            client_secret=conf.client_secret,
+            user_agent=conf.user_agent,
+        )
 
-    if hasattr(submission, "over_18"):
-        if submission.over_18 and (not conf.mature_content_allowed):
-            return
+    budget = RequestBudget(
+        redis_utils.connection, conf.client_id, conf.api_rate, conf.api_burst
+    )
+    return praw.Reddit(
+        client_id=conf.client_id,
+        client_secret=conf.client_secret,
+        user_agent=conf.user_agent,
+        requestor_class=BudgetedRequestor,
+        requestor_kwargs={"budget": budget},
+    )
 
-    url = submission.url if hasattr(submission, "url") else None
 
-    if url_was_already_processed(url):
-        return
+def submit_submission(
+    pipeline: Pipeline, submission: Submission, conf: GrabberConfiguration
+) -> None:
+    task = accept_submission(submission, conf)
+    if task:
+        pipeline.put(task)
 
-    phash = str(get_hash(get_image(submission)))
 
-    if phash_was_already_processed(phash):
-        register_submission(url=url, phash=None, ttl=conf.redis_internal_ttl)
+def stream_submission(
+    pipeline: Pipeline,
+    submission: Submission,
+    conf: GrabberConfiguration,
+    cursor: StreamCursor,
+) -> None:
+    if not cursor.is_new(submission):
         return
 
-    register_submission(url=url, phash=phash, ttl=conf.redis_internal_ttl)
-    publish_submission(GotRedditEvent.from_submission(submission, conf))
+    task = accept_submission(submission, conf)
+    processed = cursor.advance(submission)
+    if not task:
+        processed()
+    else:
+        when_processed(task, processed)
+        pipeline.put(task)
+    cursor.flush()
+
+
+def stats_loop(conf: GrabberConfiguration) -> None:
+    while True:
+        time.sleep(conf.stats_interval)
+        try:
+            publish_stats(conf.service_id)
+        except Exception as e:
+            print(e)
 
 
 def stream_loop(conf: GrabberConfiguration) -> None:
-    reddit = praw.Reddit(
-        client_id=conf.client_id,
-        client_secret=conf.client_secret,
-        user_agent=conf.user_agent,
-    )
+    reddit = connect_to_reddit(conf)
 
-    with ThreadPoolExecutor(max_workers=conf.thread_count) as executor:
-        for sub in reddit.subreddit(conf.subreddit_name).stream.submissions():
-            sub: Submission = sub
-            executor.submit(process_submission(sub, conf))
+    cursor = StreamCursor(redis_utils.connection, conf.cursor_interval)
+    cursor.load(conf.subreddit_name)
 
+    try:
+        with build_pipeline(conf) as pipeline:
+            for sub in reddit.subreddit(conf.subreddit_name).stream.submissions():
+                sub: Submission = sub
+                stream_submission(pipeline, sub, conf, cursor)
+    finally:
+        cursor.flush(force=True)
 
-def post_loop(conf: GrabberConfiguration) -> None:
 
-    reddit = praw.Reddit(
-        client_id=conf.client_id,
-        client_secret=conf.client_secret,
-        user_agent=conf.user_agent,
+def start_sharding(conf: GrabberConfiguration) -> ShardCoordinator:
+    coordinator = ShardCoordinator(
+        redis_utils.connection,
+        conf.service_id,
+        conf.subreddit_name.split("+"),
+        conf.lease_ttl,
     )
+    coordinator.refresh()
+    Thread(
+        target=heartbeat_loop, args=(coordinator, conf.heartbeat_interval), daemon=True
+    ).start()
+
+    return coordinator
+
+
+def sharded_stream_loop(conf: GrabberConfiguration) -> None:
+    reddit = connect_to_reddit(conf)
+
+    coordinator = start_sharding(conf)
+    cursor = StreamCursor(redis_utils.connection, conf.cursor_interval)
+    owned: Set[str] = set()
+    stream: Optional[Iterator[Optional[Submission]]] = None
+
+    try:
+        with build_pipeline(conf) as pipeline:
+            while True:
+                if coordinator.owned != owned:
+                    owned = coordinator.owned
+                    # A new set of subreddits is a new stream with its own cursor
+                    cursor.flush(force=True)
+                    cursor.load("+".join(owned))
+                    # pause_after=0 makes the stream yield None after every empty
+                    # poll, so changes in ownership are noticed on quiet subreddits
+                    stream = (
+                        reddit.subreddit("+".join(sorted(owned))).stream.submissions(
+                            pause_after=0
+                        )
+                        if owned
+                        else None
+                    )
+
+                if stream is None:
+                    time.sleep(conf.heartbeat_interval)
+                    continue
+
+                sub = next(stream)
+                if sub is not None:
+                    stream_submission(pipeline, sub, conf, cursor)
+                else:
+                    cursor.flush()
+    finally:
+        cursor.flush(force=True)
+        coordinator.leave()
 
-    if conf.mode == "hot":
-        source = reddit.subreddit(conf.subreddit_name).hot(limit=config.post_window)
-    elif conf.mode == "rising":
-        source = reddit.subreddit(conf.subreddit_name).rising(limit=config.post_window)
-    else:
-        raise RedditGrabberException(
-            f"Critical error. Mode {conf.mode} can't be used for post_loop"
-        )
 
-    seen_posts: FiniteList = FiniteList(conf.post_history_cache_len)
+def post_loop(conf: GrabberConfiguration) -> None:
+
+    reddit = connect_to_reddit(conf)
+
+    coordinator = start_sharding(conf) if conf.sharding else None
+    seen_posts: BoundedSet = BoundedSet(conf.post_history_cache_len)
+    ranker: Optional[VelocityRanker] = None
+    observe: Optional[Callable[[Submission], None]] = None
+    if conf.rank_top_k:
+        ranker = VelocityRanker(
+            conf.rank_top_k,
+            conf.rank_window,
+            conf.rank_max_tracked,
+            conf.rank_max_refreshed,
+            get_current_utc_timestamp(),
+        )
+        observe = lambda s: ranker.observe(s, get_current_utc_timestamp())
 
-    with ThreadPoolExecutor(max_workers=conf.thread_count) as executor:
+    with build_pipeline(conf) as pipeline:
         while True:
             scheduled_timestamp: float = get_current_utc_timestamp() + conf.sleep_time
 
-            for sub in source:
-                sub: Submission = sub
-                if hasattr(sub, "url"):
-                    if sub.url in seen_posts:
+            if coordinator is None:
+                subreddit_name = conf.subreddit_name
+            else:
+                subreddit_name = "+".join(sorted(coordinator.owned))
+
+            if subreddit_name:
+                for sub in fetch_new_submissions(
+                    reddit.subreddit(subreddit_name),
+                    conf.mode,
+                    conf.post_window,
+                    conf.page_size,
+                    seen_posts,
+                    observe,
+                ):
+                    sub: Submission = sub
+                    if ranker is None:
+                        submit_submission(pipeline, sub, conf)
                         continue
-                    seen_posts.append(sub.url)
-                executor.submit(process_submission(sub, conf))
+
+                    task = accept_submission(sub, conf)
+                    if task:
+                        ranker.add(task, get_current_utc_timestamp())
+
+            if ranker is not None:
+                now = get_current_utc_timestamp()
+                if ranker.window_over(now):
+                    ranker.refresh(reddit, now)
+                pipeline.put_all(ranker.due(now, is_known))
 
             current_timestamp = get_current_utc_timestamp()
 
@@ -97,12 +211,29 @@ def post_loop(conf: GrabberConfiguration) -> None:
                 time.sleep(scheduled_timestamp - current_timestamp)
 
 
+def backfill_loop(conf: GrabberConfiguration) -> None:
+    reddit = connect_to_reddit(conf)
+
+    with build_pipeline(conf) as pipeline:
+        run_backfill(redis_utils.connection, reddit, pipeline, conf)
+
+    print("Backfill is finished")
+
+
 if __name__ == "__main__":
 
     config = get_configuration()
     connect_to_redis(config)
 
-    if config.stream_mode():
-        stream_loop(config)
+    if config.stats_interval:
+        Thread(target=stats_loop, args=(config,), daemon=True).start()
+
+    if config.backfill_mode():
+        backfill_loop(config)
+    elif config.stream_mode():
+        if config.sharding:
+            sharded_stream_loop(config)
+        else:
+            stream_loop(config)
     else:
         post_loop(config)
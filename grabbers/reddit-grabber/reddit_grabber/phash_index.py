@@ -0,0 +1,247 @@
+import heapq
+import math
+from itertools import combinations
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from redis import StrictRedis
+
+hash_bits = 64
+
+
+def phash_to_int(phash: str) -> int:
+    return int(phash, 16)
+
+
+def phash_to_str(h: int) -> str:
+    return f"{h:0{hash_bits // 4}x}"
+
+
+try:
+    popcount = int.bit_count  # Python 3.10+
+except AttributeError:
+
+    def popcount(x: int) -> int:
+        return bin(x).count("1")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return popcount(a ^ b)
+
+
+def chunk_bounds(chunks: int) -> List[Tuple[int, int]]:
+    # (offset, mask) of every chunk, chunks may differ in size by one bit when
+    # 64 isn't divisible by `chunks`
+    bounds: List[Tuple[int, int]] = []
+    offset = 0
+    for i in range(chunks):
+        bits = hash_bits // chunks + (1 if i < hash_bits % chunks else 0)
+        bounds.append((offset, (1 << bits) - 1))
+        offset += bits
+    return bounds
+
+
+def masks_within(bits: int, radius: int) -> List[int]:
+    masks: List[int] = []
+    for r in range(radius + 1):
+        for positions in combinations(range(bits), r):
+            mask = 0
+            for p in positions:
+                mask |= 1 << p
+            masks.append(mask)
+    return masks
+
+
+class PhashIndex:
+    """
+    Multi-index hashing over 64-bit phashes.
+
+    Every hash is split into `chunks` pieces and each piece is indexed in its
+    own table. If two hashes are within `max_distance` bits, at least one of
+    their pieces differs by no more than `max_distance // chunks` bits, so only
+    the buckets around the query's pieces have to be checked.
+    """
+
+    def __init__(self, max_distance: int, chunks: int = 3) -> None:
+        self.max_distance: int = max_distance
+        self.chunks: int = chunks
+        self._bounds: List[Tuple[int, int]] = chunk_bounds(chunks)
+        self._neighbours: List[List[int]] = [
+            masks_within(mask.bit_length(), max_distance // chunks)
+            for _, mask in self._bounds
+        ]
+
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in range(chunks)]
+        self._expires: Dict[int, float] = {}
+        self._expiration_heap: List[Tuple[float, int]] = []
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def _pieces(self, h: int) -> List[int]:
+        return [(h >> offset) & mask for offset, mask in self._bounds]
+
+    def _remove(self, h: int) -> None:
+        del self._expires[h]
+        for table, piece in zip(self._tables, self._pieces(h)):
+            bucket = table[piece]
+            bucket.discard(h)
+            if not bucket:
+                del table[piece]
+
+    def _remove_expired(self, now: float) -> None:
+        heap = self._expiration_heap
+        while heap and heap[0][0] <= now:
+            expire, h = heapq.heappop(heap)
+            # Entries re-added with a later expiration leave stale heap records
+            if self._expires.get(h) == expire:
+                self._remove(h)
+
+    def add(self, h: int, expire: float = math.inf) -> None:
+        with self._lock:
+            current = self._expires.get(h)
+            if current is not None:
+                if expire <= current:
+                    return
+            else:
+                for table, piece in zip(self._tables, self._pieces(h)):
+                    table.setdefault(piece, set()).add(h)
+
+            self._expires[h] = expire
+            if expire != math.inf:
+                heapq.heappush(self._expiration_heap, (expire, h))
+
+    def remove(self, hashes: Iterable[int]) -> None:
+        with self._lock:
+            for h in hashes:
+                if h in self._expires:
+                    self._remove(h)
+
+    def find(self, h: int, now: float) -> Optional[int]:
+        with self._lock:
+            self._remove_expired(now)
+
+            if h in self._expires:
+                return h
+
+            max_distance = self.max_distance
+            for table, piece, neighbours in zip(
+                self._tables, self._pieces(h), self._neighbours
+            ):
+                # map/filter keep the bucket probing loop out of the interpreter
+                buckets = filter(None, map(table.get, map(piece.__xor__, neighbours)))
+                for bucket in buckets:
+                    for candidate in bucket:
+                        if popcount(h ^ candidate) <= max_distance:
+                            return candidate
+
+        return None
+
+
+# Expired members are dropped on every add, so busy buckets that never reach
+# their EXPIREAT still stay bounded. ARGV: expiration time, phash, now.
+add_to_buckets_script = """
+for _, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', ARGV[3])
+    redis.call('ZADD', key, ARGV[1], ARGV[2])
+    local top = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')
+    if top[2] == 'inf' then
+        redis.call('PERSIST', key)
+    else
+        redis.call('EXPIREAT', key, math.ceil(tonumber(top[2])))
+    end
+end
+"""
+
+
+class RedisPhashIndex:
+    """
+    Locality-sensitive banding of phashes stored in Redis, shared by every grabber
+    that uses the same database.
+
+    Every hash is split into `bands` pieces and stored in one SortedSet per
+    (band, piece) pair with its expiration time as the score. Candidates are the
+    members of the query's buckets and only they are compared bit by bit.
+    With `bands` > `max_distance` every near duplicate shares at least one
+    bucket with the query, fewer bands make buckets more selective but let
+    some of the farther duplicates through.
+    """
+
+    def __init__(
+        self,
+        connection: StrictRedis,
+        prefix: str,
+        max_distance: int,
+        bands: int,
+        clock: Callable[[], float],
+    ) -> None:
+        self.connection: StrictRedis = connection
+        # Must be the clock expiration times are computed with
+        self.clock: Callable[[], float] = clock
+        self.prefix: str = prefix
+        self.max_distance: int = max_distance
+        self._bounds: List[Tuple[int, int]] = chunk_bounds(bands)
+        self._add_to_buckets = connection.register_script(add_to_buckets_script)
+
+    def bucket_keys(self, h: int) -> List[str]:
+        return [
+            f"{self.prefix}:{band}:{(h >> offset) & mask:x}"
+            for band, (offset, mask) in enumerate(self._bounds)
+        ]
+
+    def add(self, h: int, expire: float = math.inf) -> None:
+        expire_time: Union[int, str] = "+inf" if expire == math.inf else int(expire)
+        self._add_to_buckets(
+            keys=self.bucket_keys(h),
+            args=[expire_time, phash_to_str(h), int(self.clock())],
+        )
+
+    def remove(self, hashes: Iterable[int]) -> None:
+        pipe = self.connection.pipeline(transaction=False)
+        for h in hashes:
+            member = phash_to_str(h)
+            for key in self.bucket_keys(h):
+                pipe.zrem(key, member)
+        pipe.execute()
+
+    def memory_usage(self, sample: List[int], entries: int) -> int:
+        """
+        Estimated memory of the buckets of `entries` hashes, from the buckets
+        of the `sample` ones. Every hash is counted with an equal share of each
+        of its buckets.
+        """
+        if not sample:
+            return 0
+
+        pipe = self.connection.pipeline(transaction=False)
+        for h in sample:
+            for key in self.bucket_keys(h):
+                pipe.memory_usage(key)
+                pipe.zcard(key)
+        results = pipe.execute()
+
+        shares = sum(
+            usage / size
+            for usage, size in zip(results[::2], results[1::2])
+            if usage and size
+        )
+        return int(shares / len(sample) * entries)
+
+    def find(self, h: int, now: float) -> Optional[int]:
+        pipe = self.connection.pipeline(transaction=False)
+        for key in self.bucket_keys(h):
+            # Entries expire at their score, like in `PhashIndex`
+            pipe.zrangebyscore(key, f"({int(now)}", "+inf")
+
+        checked: Set[bytes] = set()
+        for bucket in pipe.execute():
+            for member in bucket:
+                if member in checked:
+                    continue
+                checked.add(member)
+                candidate = phash_to_int(member.decode())
+                if popcount(h ^ candidate) <= self.max_distance:
+                    return candidate
+
+        return None
@@ -0,0 +1,158 @@
+import traceback
+from queue import Queue, Empty
+from threading import Thread
+from typing import Any, Callable, List, Optional, Iterable
+
+_stop = object()
+
+
+class Stage:
+    """
+    One step of the pipeline: `workers` threads take items from a bounded inbound
+    queue and pass them to `handler`. The handler returns the item for the next
+    stage, `None` to drop it, or a list of items to fan out.
+
+    With `batch_size` > 1 the handler gets a list of up to `batch_size` items
+    that were already waiting in the queue and returns a list of results.
+
+    If the handler raises, `on_error` gets the items it was working on, so
+    whatever they hold (claims, pending groups) can be given up.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Any],
+        workers: int,
+        queue_len: int,
+        batch_size: int = 1,
+        on_error: Optional[Callable[[List[Any]], None]] = None,
+    ) -> None:
+        self.name: str = name
+        self.handler: Callable[[Any], Any] = handler
+        self.workers: int = max(1, workers)
+        self.batch_size: int = max(1, batch_size)
+        self.on_error: Optional[Callable[[List[Any]], None]] = on_error
+        self.queue: Queue = Queue(maxsize=max(1, queue_len))
+        self.next: Optional["Stage"] = None
+        self._threads: List[Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            t = Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def put(self, item: Any) -> None:
+        # Blocks while the stage is saturated, which throttles everything upstream
+        self.queue.put(item)
+
+    def stop(self) -> None:
+        for _ in self._threads:
+            self.queue.put(_stop)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _forward(self, result: Any) -> None:
+        if result is None or self.next is None:
+            return
+
+        if isinstance(result, list):
+            for r in result:
+                if r is not None:
+                    self.next.put(r)
+        else:
+            self.next.put(result)
+
+    def _take(self) -> List[Any]:
+        # Waits for one item, then grabs whatever else is ready without waiting
+        items = [self.queue.get()]
+        while len(items) < self.batch_size and items[-1] is not _stop:
+            try:
+                items.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return items
+
+    def _give_up(self, items: List[Any]) -> None:
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(items)
+        except Exception as e:
+            print(f"Stage {self.name} failed to give up its items: {e}")
+            traceback.print_exc()
+
+    def _run(self) -> None:
+        while True:
+            items = self._take()
+            stopped = items[-1] is _stop
+            work = items[:-1] if stopped else items
+            try:
+                if work:
+                    if self.batch_size > 1:
+                        self._forward(self.handler(work))
+                    else:
+                        self._forward(self.handler(work[0]))
+            except Exception as e:
+                print(f"Stage {self.name} failed: {e}")
+                traceback.print_exc()
+                self._give_up(work)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+            if stopped:
+                return
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues. `put` blocks once the first
+    stage is full, so a fast producer can't outrun the slowest stage.
+
+    `on_stop` runs once every stage has stopped, to release what the stages
+    shared (worker processes, connection pools).
+    """
+
+    def __init__(
+        self, stages: List[Stage], on_stop: Optional[Callable[[], None]] = None
+    ) -> None:
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+
+        self.stages: List[Stage] = stages
+        self.on_stop: Optional[Callable[[], None]] = on_stop
+        for current, following in zip(stages, stages[1:]):
+            current.next = following
+
+    def start(self) -> "Pipeline":
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def put(self, item: Any) -> None:
+        self.stages[0].put(item)
+
+    def put_all(self, items: Iterable[Any]) -> None:
+        for item in items:
+            self.put(item)
+
+    def join(self) -> None:
+        # Stages are drained in order, so nothing can be re-queued upstream
+        for stage in self.stages:
+            stage.queue.join()
+
+    def stop(self) -> None:
+        self.join()
+        for stage in self.stages:
+            stage.stop()
+        if self.on_stop is not None:
+            self.on_stop()
+
+    def __enter__(self) -> "Pipeline":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from itertools import chain, zip_longest
+from typing import Callable, Dict, List, Optional
+
+import praw
+from praw.reddit import Submission
+
+from reddit_grabber import stats
+from reddit_grabber.stages import SubmissionTask
+from reddit_grabber.utils import listing_value
+
+# Young posts have too few votes to say anything, their age is rounded up
+min_age = 60
+
+
+class RankedCandidate:
+    __slots__ = ("task", "first_seen", "first_ups", "last_seen", "last_ups")
+
+    def __init__(self, task: SubmissionTask, now: float) -> None:
+        ups = listing_value(task.submission, "ups", 0)
+        self.task: SubmissionTask = task
+        self.first_seen: float = now
+        self.first_ups: int = ups
+        self.last_seen: float = now
+        self.last_ups: int = ups
+
+    def velocity(self, now: float) -> float:
+        # Upvotes per second between sightings, or since creation if the post
+        # was seen too briefly to tell
+        if self.last_seen - self.first_seen >= min_age:
+            return (self.last_ups - self.first_ups) / (self.last_seen - self.first_seen)
+
+        created = listing_value(self.task.submission, "created_utc", now)
+        return self.last_ups / max(min_age, now - created)
+
+
+class VelocityRanker:
+    """
+    Holds back accepted submissions and forwards only the `top_k` fastest
+    growing ones of every subreddit once per `window` seconds. Upvotes are
+    re-read on every listing pass. Candidates that didn't make it stay for
+    the next windows until `max_tracked` newer ones push them out.
+    """
+
+    def __init__(
+        self, top_k: int, window: int, max_tracked: int, max_refreshed: int, now: float
+    ) -> None:
+        self.top_k: int = top_k
+        self.window: int = window
+        self.max_tracked: int = max_tracked
+        self.max_refreshed: int = max_refreshed
+        self.window_end: float = now + window
+        self._candidates: "OrderedDict[str, RankedCandidate]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._candidates)
+
+    def add(self, task: SubmissionTask, now: float) -> None:
+        fullname = task.submission.fullname
+        if fullname in self._candidates:
+            return
+
+        self._candidates[fullname] = RankedCandidate(task, now)
+        if len(self._candidates) > self.max_tracked:
+            self._candidates.popitem(last=False)
+            stats.increment("rank_evicted")
+
+    def observe(self, submission: Submission, now: float) -> None:
+        candidate = self._candidates.get(submission.fullname)
+        ups = listing_value(submission, "ups")
+        if candidate is not None and ups is not None:
+            candidate.last_seen = now
+            candidate.last_ups = ups
+
+    def window_over(self, now: float) -> bool:
+        return now >= self.window_end
+
+    def ranked(self, now: float) -> List[List[RankedCandidate]]:
+        # Candidates of every subreddit, fastest growing first
+        by_subreddit: Dict[str, List[RankedCandidate]] = {}
+        for candidate in self._candidates.values():
+            subreddit = candidate.task.submission.subreddit.display_name.lower()
+            by_subreddit.setdefault(subreddit, []).append(candidate)
+
+        for candidates in by_subreddit.values():
+            candidates.sort(key=lambda c: c.velocity(now), reverse=True)
+        return list(by_subreddit.values())
+
+    def refresh(self, reddit: praw.Reddit, now: float) -> None:
+        """
+        Re-reads the upvotes of the `max_refreshed` best candidates, so those
+        the listing passes didn't reach again are ranked by the same measure
+        as the rest. Subreddits take turns, so each gets its contenders
+        refreshed. praw asks for 100 submissions per request.
+        """
+        turns = chain.from_iterable(zip_longest(*self.ranked(now)))
+        fullnames = [
+            candidate.task.submission.fullname
+            for candidate in turns
+            if candidate is not None
+        ][: self.max_refreshed]
+        for submission in reddit.info(fullnames=fullnames):
+            self.observe(submission, now)
+        stats.increment("rank_refreshed", len(fullnames))
+
+    def due(
+        self,
+        now: float,
+        is_known: Optional[Callable[[SubmissionTask], bool]] = None,
+    ) -> List[SubmissionTask]:
+        """
+        Returns the submissions to forward if the window is over, otherwise
+        an empty list. Candidates for which `is_known` is true were processed
+        elsewhere in the meantime and are dropped without taking a place.
+        """
+        if not self.window_over(now):
+            return []
+        self.window_end = now + self.window
+
+        forwarded: List[SubmissionTask] = []
+        for candidates in self.ranked(now):
+            taken = 0
+            for candidate in candidates:
+                if taken == self.top_k:
+                    break
+                del self._candidates[candidate.task.submission.fullname]
+                if is_known is not None and is_known(candidate.task):
+                    stats.increment("rank_known")
+                    continue
+                forwarded.append(candidate.task)
+                taken += 1
+
+        stats.increment("rank_forwarded", len(forwarded))
+        return forwarded
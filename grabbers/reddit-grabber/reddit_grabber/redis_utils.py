@@ -1,56 +1,489 @@
-from typing import Optional, Union, Callable
+import json
+import math
+import random
+from threading import Thread
+from typing import Optional, Union, Callable, Dict, List
+from urllib.parse import quote
 
 import redis
 from redis import StrictRedis
+from redis.client import Script
 
+from reddit_grabber import stats
+from reddit_grabber.bloom import RotatingBloomFilter
+from reddit_grabber.cache import DedupeCache
 from reddit_grabber.events import GotRedditEvent
 from reddit_grabber.exceptions import RedditGrabberException
+from reddit_grabber.phash_index import (
+    PhashIndex,
+    RedisPhashIndex,
+    phash_to_int,
+    phash_to_str,
+)
+from reddit_grabber.retention import MemoryBudget
 from reddit_grabber.utils import GrabberConfiguration, get_current_utc_timestamp
 
 connection: Optional[StrictRedis] = None
+phash_index: Optional[Union[PhashIndex, RedisPhashIndex]] = None
+url_filter: Optional[RotatingBloomFilter] = None
+url_filter_exact: bool = False
+url_cache: Optional[DedupeCache] = None
+phash_cache: Optional[DedupeCache] = None
+
+url_budget: Optional[MemoryBudget] = None
+phash_budget: Optional[MemoryBudget] = None
+fingerprint_budget: Optional[MemoryBudget] = None
+
+claim_script: Optional[Script] = None
+release_fetch_script: Optional[Script] = None
+
+cleanup_interval: int = 0
+last_cleanup: int = 0
 
 url_db = "gr_urls"
 phash_db = "gr_phashes"
+fingerprint_db = "gr_fingerprints"
+url_filter_prefix = "gr_urls_bf"
+phash_bands_prefix = "gr_phash_bands"
 gr_events = "grabbers.events"
+gr_tag_events = "grabbers.events.tags"
+gr_registered = "grabbers.registered"
+# Phashes whose band buckets are measured to estimate the memory of all buckets
+band_memory_sample = 16
+gr_stats = "gr_stats"
+fetch_claim_prefix = "gr_fetching"
+fetch_done = "done"
+
+# KEYS[1]: SortedSet scored by expiration time. ARGV: member, current time,
+# new expiration time, then optionally a channel and a message announcing the
+# claim. Returns 1 if the member was claimed, 0 if it was already there.
+claim_member_script = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score then
+    if score == 'inf' or tonumber(score) > tonumber(ARGV[2]) then
+        return 0
+    end
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+if ARGV[4] then
+    redis.call('PUBLISH', ARGV[4], ARGV[5])
+end
+return 1
+"""
+
+# Deletes a download claim only if it still belongs to ARGV[1]
+release_claim_script = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
 
 
 def connect_to_redis(config: GrabberConfiguration) -> None:
     global connection
+    global cleanup_interval
+    global url_cache
+    global phash_cache
+    global url_filter
+    global url_filter_exact
+    global claim_script
+    global release_fetch_script
+    global url_budget
+    global phash_budget
+    global fingerprint_budget
     if connection is not None:
         return
     connection = redis.StrictRedis(
         host=config.redis_host, port=config.redis_port, db=config.redis_db
     )
 
+    claim_script = connection.register_script(claim_member_script)
+    release_fetch_script = connection.register_script(release_claim_script)
+
+    cleanup_interval = config.redis_cleanup_interval
+
+    url_budget = create_budget("urls", url_db, config.urls_max_memory, config)
+    phash_budget = create_budget(
+        "phashes", phash_db, config.phashes_max_memory, config, band_memory_usage
+    )
+    fingerprint_budget = create_budget(
+        "fingerprints", fingerprint_db, config.fingerprints_max_memory, config
+    )
+
+    if config.url_filter == "bloom":
+        url_filter = RotatingBloomFilter(
+            connection,
+            url_filter_prefix,
+            capacity=config.url_filter_capacity,
+            error_rate=config.url_filter_error_rate,
+            partition_time=config.url_filter_partition_time,
+            partitions=config.url_filter_partitions,
+        )
+        url_filter_exact = config.url_filter_exact
+
+    if config.cache_len:
+        url_cache = DedupeCache("url_cache", config.cache_len, config.cache_miss_ttl)
+        phash_cache = DedupeCache(
+            "phash_cache", config.cache_len, config.cache_miss_ttl
+        )
+
+    if config.phash_distance:
+        if config.phash_index == "redis":
+            load_redis_phash_index(config.phash_distance, config.phash_bands)
+        else:
+            load_phash_index(config.phash_distance)
+
+    # Evictions are announced on the same channel
+    if url_cache is not None or isinstance(phash_index, PhashIndex):
+        subscribe(gr_registered, registered_handler)
+
+
+def create_budget(
+    name: str,
+    key: str,
+    max_bytes: int,
+    config: GrabberConfiguration,
+    companion_usage: Optional[Callable[[int], int]] = None,
+) -> Optional[MemoryBudget]:
+    if not max_bytes:
+        return None
+
+    budget = MemoryBudget(
+        connection, name, key, max_bytes, config.dedupe_hit_bonus, companion_usage
+    )
+    budget.seed()
+    return budget
+
+
+def band_memory_usage(entries: int) -> int:
+    # Measuring every bucket would take a round trip per key
+    if not isinstance(phash_index, RedisPhashIndex):
+        return 0
+
+    # ZRANDMEMBER needs Redis 6.2, picking random ranks works anywhere
+    ranks = random.sample(range(entries), min(entries, band_memory_sample))
+    pipe = connection.pipeline(transaction=False)
+    for rank in ranks:
+        pipe.zrange(phash_db, rank, rank)
+    sample = [phash for found in pipe.execute() for phash in found]
+
+    return phash_index.memory_usage(
+        [phash_to_int(phash.decode()) for phash in sample], entries
+    )
+
+
+def forget(urls: List[str], phashes: List[str]) -> None:
+    # Evicted entries must not keep catching duplicates from local state
+    if url_cache is not None:
+        url_cache.discard(urls)
+    if phash_cache is not None:
+        phash_cache.discard(phashes)
+    if isinstance(phash_index, PhashIndex):
+        phash_index.remove(phash_to_int(phash) for phash in phashes)
+
+
+def evicted(urls: List[str], phashes: List[str]) -> None:
+    # Band buckets are shared, so the grabber that evicted cleans them up
+    if phashes and isinstance(phash_index, RedisPhashIndex):
+        phash_index.remove(phash_to_int(phash) for phash in phashes)
+
+    forget(urls, phashes)
+    message = {"evicted": True, "urls": urls, "phashes": phashes}
+    connection.publish(gr_registered, json.dumps(message, separators=(",", ":")))
+
+
+def fill_phash_index(index: Union[PhashIndex, RedisPhashIndex]) -> None:
+    current_time = get_current_utc_timestamp()
+    for phash, expire_time in connection.zscan_iter(phash_db):
+        if expire_time > current_time:
+            index.add(phash_to_int(phash.decode()), expire_time)
+
+
+def load_phash_index(max_distance: int) -> None:
+    global phash_index
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    index = PhashIndex(max_distance)
+    fill_phash_index(index)
+
+    phash_index = index
+
+
+def load_redis_phash_index(max_distance: int, bands: int) -> None:
+    global phash_index
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    prefix = f"{phash_bands_prefix}_{bands}"
+    index = RedisPhashIndex(
+        connection, prefix, max_distance, bands, get_current_utc_timestamp
+    )
+
+    # Buckets are shared, so only the first grabber to come up fills them
+    if connection.set(f"{prefix}_built", 1, nx=True):
+        fill_phash_index(index)
+
+    phash_index = index
+
 
 def remove_expired_submissions(func: Callable) -> Callable:
     def func_wrapper(*args, **kwargs):
+        global last_cleanup
         res = func(*args, **kwargs)
 
         if not connection:
             raise RedditGrabberException("There is no connection to ")
         current_time = int(get_current_utc_timestamp())
-        connection.zremrangebyscore(url_db, "-inf", current_time)
-        connection.zremrangebyscore(phash_db, "-inf", current_time)
+
+        # Lookups ignore expired scores, so the cleanup only has to keep memory in check
+        if current_time - last_cleanup < cleanup_interval:
+            return res
+        last_cleanup = current_time
+
+        pipe = connection.pipeline(transaction=False)
+        for db, budget in (
+            (url_db, url_budget),
+            (phash_db, phash_budget),
+            (fingerprint_db, fingerprint_budget),
+        ):
+            if budget is None:
+                pipe.zremrangebyscore(db, "-inf", current_time)
+        pipe.execute()
+
+        # Budgeted stores also drop expired entries from their value sets
+        urls = url_budget.cleanup(current_time) if url_budget is not None else []
+        phashes = (
+            phash_budget.cleanup(current_time) if phash_budget is not None else []
+        )
+        if fingerprint_budget is not None:
+            fingerprint_budget.cleanup(current_time)
+        if urls or phashes:
+            evicted(urls, phashes)
 
         return res
 
     return func_wrapper
 
 
+def subscribe(channel: str, handler: Callable) -> Thread:
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    p = connection.pubsub()
+    p.subscribe(**{channel: handler})
+
+    return p.run_in_thread(sleep_time=0.001, daemon=True)
+
+
+def registered_handler(event: Dict) -> None:
+    # Keeps the caches of all grabbers coherent with each other's registrations
+    d = json.loads(event["data"])
+    if d.get("evicted"):
+        forget(d["urls"], d["phashes"])
+        return
+
+    expire_time = d["expire"] if d["expire"] is not None else math.inf
+
+    if url_cache is not None and d.get("url"):
+        url_cache.put_processed(d["url"], expire_time)
+
+    if phash_cache is not None and d.get("phash"):
+        phash_cache.put_processed(d["phash"], expire_time)
+
+
+def publish_stats(service_id: str) -> None:
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    values = stats.snapshot()
+    if values:
+        connection.hset(f"{gr_stats}:{service_id}", mapping=values)
+
+
+def is_alive(expire_time: Optional[float], current_time: float) -> bool:
+    return expire_time is not None and expire_time > current_time
+
+
+def get_expire_time(utc_timestamp: float, ttl: Optional[int]) -> Union[int, str]:
+    return int(utc_timestamp + ttl) if ttl else "+inf"
+
+
+def registered_message(
+    url: Optional[str], phash: Optional[str], expire_time: Union[int, str]
+) -> str:
+    message = {
+        "url": url,
+        "phash": phash,
+        "expire": None if expire_time == "+inf" else expire_time,
+    }
+    return json.dumps(message, separators=(",", ":"))
+
+
+def claim_member(
+    db: str, member: str, expire_time: Union[int, str], message: str
+) -> bool:
+    args = [member, get_current_utc_timestamp(), expire_time]
+    if url_cache is not None or phash_cache is not None:
+        args += [gr_registered, message]
+    return bool(claim_script(keys=[db], args=args))
+
+
 @remove_expired_submissions
-def register_submission(
-    url: Optional[str], phash: Optional[str], ttl: Optional[int]
-) -> None:
+def claim_url(url: Optional[str], ttl: Optional[int]) -> bool:
+    """
+    Atomically checks that the url wasn't processed and registers it.
+    Returns False if another worker (or grabber) has already done it.
+    """
     if not connection:
         raise RedditGrabberException("There is no connection to Redis")
+
+    if not url:
+        return True
+
+    utc_timestamp = get_current_utc_timestamp()
+    expire_time = get_expire_time(utc_timestamp, ttl)
+
+    if url_filter is not None and not url_filter_exact:
+        claimed = url_filter.claim(url, utc_timestamp)
+    else:
+        message = registered_message(url, None, expire_time)
+        claimed = claim_member(url_db, url, expire_time, message)
+        if claimed and url_filter is not None:
+            url_filter.add(url, utc_timestamp)
+        if url_budget is not None:
+            if claimed:
+                url_budget.added([url], utc_timestamp)
+            else:
+                url_budget.hit(url)
+
+    if url_cache is not None:
+        url_cache.put_processed(
+            url, math.inf if expire_time == "+inf" else expire_time
+        )
+
+    return claimed
+
+
+@remove_expired_submissions
+def claim_phash(phash: Optional[str], ttl: Optional[int]) -> bool:
+    """
+    Atomically checks that the exact phash wasn't processed and registers it.
+    Near duplicates have to be checked beforehand with `phash_was_already_processed`.
+    """
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    if not phash:
+        return True
+
     utc_timestamp = get_current_utc_timestamp()
-    expire_time: Union[int, str] = int(utc_timestamp + ttl) if ttl else "+inf"
+    expire_time = get_expire_time(utc_timestamp, ttl)
+    expire: float = math.inf if expire_time == "+inf" else expire_time
+    message = registered_message(None, phash, expire_time)
+    claimed = claim_member(phash_db, phash, expire_time, message)
+
+    if phash_budget is not None:
+        if claimed:
+            phash_budget.added([phash], utc_timestamp)
+        else:
+            phash_budget.hit(phash)
+
+    if claimed and phash_index is not None:
+        phash_index.add(phash_to_int(phash), expire)
+
+    if phash_cache is not None:
+        phash_cache.put_processed(phash, expire)
+
+    return claimed
+
+
+@remove_expired_submissions
+def fingerprints_were_processed(fingerprints: List[str]) -> bool:
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    if not fingerprints:
+        return False
+
+    pipe = connection.pipeline(transaction=False)
+    for fingerprint in fingerprints:
+        pipe.zscore(fingerprint_db, fingerprint)
+    expire_times = pipe.execute()
+
+    current_time = get_current_utc_timestamp()
+    known = [
+        f
+        for f, expire in zip(fingerprints, expire_times)
+        if is_alive(expire, current_time)
+    ]
+    if fingerprint_budget is not None:
+        for fingerprint in known:
+            fingerprint_budget.hit(fingerprint)
+
+    return bool(known)
+
+
+def register_fingerprints(fingerprints: List[str], ttl: Optional[int]) -> None:
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    if fingerprints:
+        utc_timestamp = get_current_utc_timestamp()
+        expire_time = get_expire_time(utc_timestamp, ttl)
+        connection.zadd(fingerprint_db, {f: expire_time for f in fingerprints})
+        if fingerprint_budget is not None:
+            fingerprint_budget.added(fingerprints, utc_timestamp)
+
+
+def fetch_claim_key(url: str) -> str:
+    return f"{fetch_claim_prefix}:{url}"
+
+
+def claim_fetch(url: Optional[str], owner: str, ttl: int) -> bool:
+    """
+    Takes the short-lived right to download `url`, so grabbers that see the
+    same url at once don't all download and hash it.
+    """
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    if not url:
+        return True
+
+    return bool(connection.set(fetch_claim_key(url), owner, nx=True, ex=ttl))
+
+
+def get_fetch_claim(url: str) -> Optional[str]:
+    if not connection:
+        raise RedditGrabberException("There is no connection to Redis")
+
+    owner = connection.get(fetch_claim_key(url))
+    return owner.decode() if owner is not None else None
+
+
+def release_fetch(url: Optional[str], owner: str) -> None:
+    # Lets others download the url after a failed attempt
+    if url:
+        release_fetch_script(keys=[fetch_claim_key(url)], args=[owner])
+
+
+def finish_fetch(url: Optional[str], ttl: int) -> None:
+    # Grabbers waiting for the download learn that the url is registered now
     if url:
-        connection.zadd(url_db, {url: expire_time})
+        connection.set(fetch_claim_key(url), fetch_done, ex=ttl)
 
-    if phash:
-        connection.zadd(phash_db, {phash: expire_time})
+
+def tag_channel(tags: List[str]) -> str:
+    """
+    Channel addressed by the event's tags, e.g. `grabbers.events.tags.<dnd><meme>`.
+    Tags are sorted and quoted, so consumers can match any subset of them with
+    a single glob pattern.
+    """
+    return f"{gr_tag_events}." + "".join(
+        f"<{quote(tag, safe='')}>" for tag in sorted(set(tags or []))
+    )
 
 
 @remove_expired_submissions
@@ -58,7 +491,11 @@ def publish_submission(event: GotRedditEvent) -> None:
     if not connection:
         raise RedditGrabberException("There is no connection to Redis")
 
-    connection.publish(gr_events, event.as_json())
+    message = event.as_json()
+    pipe = connection.pipeline(transaction=False)
+    pipe.publish(gr_events, message)
+    pipe.publish(tag_channel(event.tags), message)
+    pipe.execute()
 
 
 @remove_expired_submissions
@@ -69,7 +506,38 @@ def url_was_already_processed(url: Optional[str]) -> bool:
     if not url:
         return False
 
-    return (connection.zscore(url_db, url) is not None)
+    current_time = get_current_utc_timestamp()
+    if url_cache is not None:
+        cached = url_cache.get(url, current_time)
+        if cached is not None:
+            return cached
+
+    if url_filter is not None:
+        # The filter never misses an added url, so only its positives may need a recheck
+        if not url_filter.contains(url, current_time):
+            expire_time = None
+        elif url_filter_exact:
+            expire_time = connection.zscore(url_db, url)
+        else:
+            expire_time = math.inf
+    else:
+        expire_time = connection.zscore(url_db, url)
+    processed = is_alive(expire_time, current_time)
+    # The Bloom filter alone has no entry to credit
+    if processed and url_budget is not None:
+        if url_filter is None or url_filter_exact:
+            url_budget.hit(url)
+
+    if url_cache is not None:
+        if processed and url_filter is not None and not url_filter_exact:
+            # The filter doesn't know when the url expires
+            url_cache.put(url, True, current_time + url_cache.miss_ttl)
+        elif processed:
+            url_cache.put_processed(url, expire_time)
+        else:
+            url_cache.put_unprocessed(url, current_time)
+
+    return processed
 
 
 @remove_expired_submissions
@@ -80,4 +548,32 @@ def phash_was_already_processed(phash: Optional[str]) -> bool:
     if not phash:
         return False
 
-    return connection.zscore(phash_db, phash) is not None
+    current_time = get_current_utc_timestamp()
+    if phash_cache is not None:
+        cached = phash_cache.get(phash, current_time)
+        if cached is not None:
+            return cached
+
+    expire_time = connection.zscore(phash_db, phash)
+    if is_alive(expire_time, current_time):
+        if phash_budget is not None:
+            phash_budget.hit(phash)
+        if phash_cache is not None:
+            phash_cache.put_processed(phash, expire_time)
+        return True
+
+    near = (
+        phash_index.find(phash_to_int(phash), current_time)
+        if phash_index is not None
+        else None
+    )
+    processed = near is not None
+    if processed and phash_budget is not None:
+        # The stored near duplicate is the entry that proved useful
+        phash_budget.hit(phash_to_str(near))
+
+    if phash_cache is not None:
+        # A near duplicate's expiration isn't known here, so it is kept as briefly as a miss
+        phash_cache.put(phash, processed, current_time + phash_cache.miss_ttl)
+
+    return processed
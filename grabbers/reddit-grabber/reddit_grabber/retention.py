@@ -0,0 +1,121 @@
+import math
+from typing import Callable, Iterable, List, Optional
+
+from redis import StrictRedis
+
+from reddit_grabber import stats
+
+# KEYS[1]: dedupe store, KEYS[2]: its value set. Drops the ARGV[1] least
+# valuable entries from both and returns those that were still in the store.
+evict_script = """
+local popped = redis.call('ZRANGE', KEYS[2], 0, ARGV[1] - 1)
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, ARGV[1] - 1)
+local evicted = {}
+for i = 1, #popped do
+    if redis.call('ZREM', KEYS[1], popped[i]) == 1 then
+        evicted[#evicted + 1] = popped[i]
+    end
+end
+return evicted
+"""
+
+# Removes up to ARGV[2] entries that expired by ARGV[1] from both sets
+remove_expired_script = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for i = 1, #expired do
+    redis.call('ZREM', KEYS[1], expired[i])
+    redis.call('ZREM', KEYS[2], expired[i])
+end
+return #expired
+"""
+
+expired_batch = 1000
+
+
+class MemoryBudget:
+    """
+    Keeps a dedupe SortedSet (scored by expiration time) under `max_bytes` of
+    Redis memory.
+
+    Every entry's value is kept in the `{key}_value` SortedSet: the time it was
+    added plus `hit_bonus` seconds for each time it caught a duplicate. When
+    the store outgrows its budget, the entries with the lowest value, i.e. the
+    oldest and least often hit ones, are evicted first.
+
+    `companion_usage` estimates the memory of other structures holding a copy
+    of every entry (e.g. phash band buckets) from the number of entries, so
+    they count towards the budget too.
+    """
+
+    def __init__(
+        self,
+        connection: StrictRedis,
+        name: str,
+        key: str,
+        max_bytes: int,
+        hit_bonus: int,
+        companion_usage: Optional[Callable[[int], int]] = None,
+    ) -> None:
+        self.connection: StrictRedis = connection
+        self.name: str = name
+        self.key: str = key
+        self.value_key: str = f"{key}_value"
+        self.max_bytes: int = max_bytes
+        self.hit_bonus: int = hit_bonus
+        self.companion_usage: Optional[Callable[[int], int]] = companion_usage
+        self._evict = connection.register_script(evict_script)
+        self._remove_expired = connection.register_script(remove_expired_script)
+
+    def seed(self) -> None:
+        # Entries stored before the budget was enabled start with the lowest value
+        if not self.connection.exists(self.value_key):
+            self.connection.zunionstore(self.value_key, {self.key: 0})
+
+    def added(self, members: Iterable[str], current_time: float) -> None:
+        mapping = {m: current_time for m in members}
+        if mapping:
+            self.connection.zadd(self.value_key, mapping)
+            stats.increment(f"{self.name}_misses", len(mapping))
+
+    def hit(self, member: str) -> None:
+        self.connection.zincrby(self.value_key, self.hit_bonus, member)
+        stats.increment(f"{self.name}_hits")
+
+    def memory_usage(self, entries: int) -> int:
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.memory_usage(self.key)
+        pipe.memory_usage(self.value_key)
+        usage = sum(usage or 0 for usage in pipe.execute())
+        if self.companion_usage is not None and entries:
+            usage += self.companion_usage(entries)
+        return usage
+
+    def cleanup(self, current_time: float) -> List[str]:
+        """
+        Removes expired entries, then evicts the least valuable ones if the
+        store is over budget. Returns the evicted entries, which callers must
+        forget wherever else they are kept.
+        """
+        while (
+            self._remove_expired(
+                keys=[self.key, self.value_key], args=[current_time, expired_batch]
+            )
+            == expired_batch
+        ):
+            pass
+
+        entries = self.connection.zcard(self.key)
+        usage = self.memory_usage(entries)
+        stats.set_value(f"{self.name}_memory", usage)
+        if usage <= self.max_bytes or not entries:
+            return []
+
+        # Going down to 90% spares an eviction round on every cleanup
+        per_entry = usage / entries
+        count = math.ceil((usage - self.max_bytes * 0.9) / per_entry)
+        evicted = [
+            m.decode()
+            for m in self._evict(keys=[self.key, self.value_key], args=[count])
+        ]
+        stats.increment(f"{self.name}_evictions", len(evicted))
+        return evicted
@@ -0,0 +1,128 @@
+import hashlib
+import time
+from bisect import bisect
+from typing import List, Set, Tuple
+
+from redis import StrictRedis
+
+from reddit_grabber.utils import get_current_utc_timestamp
+
+replicas_db = "gr_replicas"
+lease_prefix = "gr_lease"
+
+# Renews (or releases when ARGV[2] is 0) a lease only if it still belongs to ARGV[1]
+update_lease_script = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '0' then
+    return redis.call('DEL', KEYS[1])
+end
+return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+"""
+
+
+def ring_point(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def build_ring(replicas: List[str], vnodes: int) -> List[Tuple[int, str]]:
+    return sorted(
+        (ring_point(f"{replica}#{i}"), replica)
+        for replica in replicas
+        for i in range(vnodes)
+    )
+
+
+def ring_owner(ring: List[Tuple[int, str]], key: str) -> str:
+    i = bisect(ring, (ring_point(key), ""))
+    return ring[i % len(ring)][1]
+
+
+class ShardCoordinator:
+    """
+    Splits subreddits between grabbers with distinct ids that share one Redis.
+
+    Every grabber keeps its heartbeat in `gr_replicas`, scored by the time it
+    expires. Subreddits are assigned to live grabbers with consistent hashing,
+    so a grabber joining or leaving moves only its own share. A grabber handles
+    a subreddit only while it holds the `gr_lease:{subreddit}` lease, which
+    protects against overlaps while grabbers disagree about who is alive: a
+    shard moves once its previous owner releases it or dies and lets it expire.
+    """
+
+    def __init__(
+        self,
+        connection: StrictRedis,
+        service_id: str,
+        subreddits: List[str],
+        lease_ttl: int,
+        vnodes: int = 64,
+    ) -> None:
+        self.connection: StrictRedis = connection
+        self.service_id: str = service_id
+        self.subreddits: List[str] = sorted({s.lower() for s in subreddits})
+        self.lease_ttl: int = lease_ttl
+        self.vnodes: int = vnodes
+        self.owned: Set[str] = set()
+        self._update_lease = connection.register_script(update_lease_script)
+
+    def lease_key(self, subreddit: str) -> str:
+        return f"{lease_prefix}:{subreddit}"
+
+    def live_replicas(self) -> List[str]:
+        current_time = get_current_utc_timestamp()
+
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.zadd(replicas_db, {self.service_id: current_time + self.lease_ttl})
+        pipe.zremrangebyscore(replicas_db, "-inf", current_time)
+        pipe.zrange(replicas_db, 0, -1)
+        replicas = pipe.execute()[-1]
+
+        return [r.decode() for r in replicas]
+
+    def assigned(self) -> Set[str]:
+        ring = build_ring(self.live_replicas(), self.vnodes)
+        return {s for s in self.subreddits if ring_owner(ring, s) == self.service_id}
+
+    def refresh(self) -> Set[str]:
+        """
+        Sends a heartbeat, renews or releases held leases and tries to take
+        newly assigned subreddits. Returns subreddits this grabber owns now.
+        """
+        assigned = self.assigned()
+        lease_ms = self.lease_ttl * 1000
+
+        for subreddit in self.owned - assigned:
+            self._update_lease(
+                keys=[self.lease_key(subreddit)], args=[self.service_id, 0]
+            )
+
+        owned: Set[str] = set()
+        for subreddit in assigned:
+            key = self.lease_key(subreddit)
+            # The lease may still be ours from before a restart
+            if self._update_lease(
+                keys=[key], args=[self.service_id, lease_ms]
+            ) or self.connection.set(key, self.service_id, nx=True, px=lease_ms):
+                owned.add(subreddit)
+
+        self.owned = owned
+        return owned
+
+    def leave(self) -> None:
+        for subreddit in self.owned:
+            self._update_lease(
+                keys=[self.lease_key(subreddit)], args=[self.service_id, 0]
+            )
+        self.connection.zrem(replicas_db, self.service_id)
+        self.owned = set()
+
+
+def heartbeat_loop(coordinator: ShardCoordinator, interval: int) -> None:
+    while True:
+        try:
+            coordinator.refresh()
+        except Exception as e:
+            print(e)
+        time.sleep(interval)
@@ -0,0 +1,455 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Optional, List, Union
+
+from praw.reddit import Submission
+
+from reddit_grabber import stats
+from reddit_grabber.events import GotRedditEvent, GotRedditGalleryEvent
+from reddit_grabber.exceptions import FetchException
+from reddit_grabber.fetch import FetchClient
+from reddit_grabber.fingerprints import lookup_fingerprints, submission_fingerprints
+from reddit_grabber.gallery import GalleryGroup, gallery_items, is_gallery
+from reddit_grabber.hashing import HashProcessPool, hash_contents
+from reddit_grabber.image_store import ImageStore
+from reddit_grabber.pipeline import Pipeline, Stage
+from reddit_grabber.redis_utils import (
+    claim_fetch,
+    fingerprints_were_processed,
+    register_fingerprints,
+    get_fetch_claim,
+    release_fetch,
+    finish_fetch,
+    fetch_done,
+    claim_url,
+    claim_phash,
+    publish_submission,
+    url_was_already_processed,
+    phash_was_already_processed,
+)
+from reddit_grabber.utils import (
+    is_image,
+    get_preview_url,
+    get_current_utc_timestamp,
+    GrabberConfiguration,
+    listing_value,
+)
+
+
+@dataclass
+class SubmissionTask:
+    submission: Submission
+    url: Optional[str] = None
+    # Set while `content` holds the preview rendition rather than the original
+    preview_url: Optional[str] = None
+    content: Optional[bytes] = None
+    phash: Optional[str] = None
+    fingerprints: List[str] = field(default_factory=list)
+    # Items of a gallery post, which are expanded by the fetch stage
+    items: List["SubmissionTask"] = field(default_factory=list)
+    # Set on gallery items, with the item's position in the gallery
+    gallery: Optional[GalleryGroup] = None
+    index: int = 0
+    # Called once the submission (every item of a gallery) left the pipeline
+    on_done: Optional[Callable[[], None]] = None
+
+
+def accept_submission(
+    submission: Submission, conf: GrabberConfiguration
+) -> Optional[SubmissionTask]:
+    gallery = conf.gallery_mode != "off" and is_gallery(submission)
+    if not gallery and not is_image(submission):
+        return None
+
+    if listing_value(submission, "over_18") and not conf.mature_content_allowed:
+        return None
+
+    if gallery:
+        return accept_gallery(submission, conf)
+
+    url = listing_value(submission, "url")
+    preview_url = get_preview_url(submission, conf.preview_min_size)
+
+    return SubmissionTask(
+        submission=submission,
+        url=url,
+        preview_url=preview_url,
+        fingerprints=lookup_fingerprints(submission),
+    )
+
+
+def accept_gallery(
+    submission: Submission, conf: GrabberConfiguration
+) -> Optional[SubmissionTask]:
+    items = gallery_items(submission, conf.preview_min_size)
+    if not items:
+        return None
+
+    group = GalleryGroup(len(items))
+    return SubmissionTask(
+        submission=submission,
+        url=listing_value(submission, "url"),
+        fingerprints=lookup_fingerprints(submission),
+        items=[
+            SubmissionTask(
+                submission=submission,
+                url=url,
+                preview_url=preview_url,
+                # Items get reposted alone or in other galleries
+                fingerprints=[f"media:{media}"],
+                gallery=group,
+                index=index,
+            )
+            for index, (media, url, preview_url) in enumerate(items)
+        ],
+    )
+
+
+def when_processed(task: SubmissionTask, callback: Callable[[], None]) -> None:
+    # Items of a gallery call it once the last of them is through
+    for t in [task] + task.items:
+        t.on_done = callback
+
+
+def item_done(
+    task: SubmissionTask,
+    conf: GrabberConfiguration,
+    published: bool = False,
+    digest: Optional[str] = None,
+) -> None:
+    """
+    Reports that a task left the pipeline. Once every item of a gallery is
+    through, the published ones are sent as one event in grouped mode.
+    """
+    if task.gallery is None:
+        if task.on_done is not None:
+            task.on_done()
+        return
+
+    published_items = task.gallery.done(
+        task.index, task.url if published else None, digest
+    )
+    if published_items is None:
+        return
+
+    try:
+        if published_items and conf.gallery_mode == "grouped":
+            urls = [url for url, _ in published_items]
+            digests = [d for _, d in published_items]
+            event = GotRedditGalleryEvent.from_submission(
+                task.submission, conf, digests[0], urls[0]
+            )
+            event.urls = urls
+            event.digests = digests
+            publish_submission(event)
+            stats.increment("gallery_grouped_events")
+    finally:
+        # Later reports of the gallery are ignored, so this is the only chance
+        if task.on_done is not None:
+            task.on_done()
+
+
+def fingerprint_stage(
+    task: SubmissionTask, conf: GrabberConfiguration
+) -> Optional[SubmissionTask]:
+    # Crossposts and link reposts are recognized by their metadata alone
+    stats.increment("fingerprint_checks")
+    if fingerprints_were_processed(task.fingerprints):
+        stats.increment("fingerprint_skipped_downloads")
+        item_done(task, conf)
+        return None
+
+    return task
+
+
+def is_known(task: SubmissionTask) -> bool:
+    # Cheap checks for submissions held back for a while, e.g. by the ranker
+    if fingerprints_were_processed(task.fingerprints):
+        return True
+    return url_was_already_processed(task.url)
+
+
+def download(task: SubmissionTask, client: FetchClient) -> Optional[bytes]:
+    # A small preview is enough for phash, the original is a few times larger
+    if task.preview_url:
+        try:
+            return client.fetch_image(task.preview_url)
+        except FetchException as e:
+            print(e)
+            task.preview_url = None
+
+    try:
+        return client.fetch_image(task.url)
+    except FetchException as e:
+        print(e)
+        return None
+
+
+def wait_for_fetch(task: SubmissionTask, conf: GrabberConfiguration) -> bool:
+    """
+    Waits while another grabber downloads the url. Returns True if the url is
+    ours to download after all (the claim was released or expired).
+    """
+    deadline = get_current_utc_timestamp() + conf.fetch_claim_wait
+    while get_current_utc_timestamp() < deadline:
+        time.sleep(0.5)
+        owner = get_fetch_claim(task.url)
+        if owner == fetch_done:
+            return False
+        if owner is None and claim_fetch(
+            task.url, conf.service_id, conf.fetch_claim_ttl
+        ):
+            return True
+
+    return False
+
+
+def give_up(tasks: List[SubmissionTask], conf: GrabberConfiguration) -> None:
+    """
+    Called for the tasks of a failed stage. Otherwise every grabber would skip
+    their urls until the fetch claims expire, and their galleries (and the
+    stream cursor) would wait for them forever. Claims already turned into
+    `done` are left alone.
+    """
+    for task in tasks:
+        for item in task.items or [task]:
+            release_fetch(item.url, conf.service_id)
+            item_done(item, conf)
+
+
+def fetch_item(
+    task: SubmissionTask, conf: GrabberConfiguration, client: FetchClient
+) -> Optional[SubmissionTask]:
+    try:
+        if fingerprints_were_processed(task.fingerprints):
+            stats.increment("fingerprint_skipped_downloads")
+            fetched = None
+        else:
+            fetched = fetch_image(task, conf, client)
+    except Exception as e:
+        # One broken item shouldn't take the rest of the gallery down
+        print(f"Unable to fetch {task.url}: {e}")
+        give_up([task], conf)
+        return None
+
+    if fetched is None:
+        item_done(task, conf)
+    return fetched
+
+
+def fetch_gallery(
+    task: SubmissionTask, conf: GrabberConfiguration, client: FetchClient
+) -> List[SubmissionTask]:
+    """
+    Downloads the items of a gallery at the same time, at most
+    `gallery_fetch_concurrency` of them, and fans them out to the hash stage.
+    Every item is deduplicated on its own.
+    """
+    stats.increment("gallery_items", len(task.items))
+    workers = min(conf.gallery_fetch_concurrency, len(task.items))
+    with ThreadPoolExecutor(workers, thread_name_prefix="gallery") as executor:
+        fetched = executor.map(
+            partial(fetch_item, conf=conf, client=client), task.items
+        )
+        return [item for item in fetched if item is not None]
+
+
+def fetch_stage(
+    task: SubmissionTask, conf: GrabberConfiguration, client: FetchClient
+) -> Union[SubmissionTask, List[SubmissionTask], None]:
+    if task.items:
+        return fetch_gallery(task, conf, client)
+
+    fetched = fetch_image(task, conf, client)
+    if fetched is None:
+        item_done(task, conf)
+    return fetched
+
+
+def fetch_image(
+    task: SubmissionTask, conf: GrabberConfiguration, client: FetchClient
+) -> Optional[SubmissionTask]:
+    if url_was_already_processed(task.url):
+        return None
+
+    if not claim_fetch(task.url, conf.service_id, conf.fetch_claim_ttl):
+        stats.increment("fetch_claimed_elsewhere")
+        if not conf.fetch_claim_wait or not wait_for_fetch(task, conf):
+            return None
+
+    task.content = download(task, client)
+    if task.content is None:
+        release_fetch(task.url, conf.service_id)
+        return None
+
+    return task
+
+
+def hash_stage(
+    tasks: List[SubmissionTask],
+    conf: GrabberConfiguration,
+    pool: Optional[HashProcessPool],
+) -> List[SubmissionTask]:
+    contents = [task.content for task in tasks]
+    if pool is not None:
+        hashes = pool.hash(contents, conf.hash_decode_size)
+    else:
+        hashes = hash_contents(contents, conf.hash_decode_size)
+
+    hashed: List[SubmissionTask] = []
+    for task, phash in zip(tasks, hashes):
+        # The image store needs the bytes of images that will be published
+        if not conf.image_store_path:
+            task.content = None
+        if phash is None:
+            print(f"Unable to decode {task.url}")
+            release_fetch(task.url, conf.service_id)
+            item_done(task, conf)
+            continue
+        task.phash = phash
+        hashed.append(task)
+
+    return hashed
+
+
+def claim_submission(task: SubmissionTask, conf: GrabberConfiguration) -> bool:
+    """
+    Registers the submission and returns whether it should be published.
+    """
+    # Whatever the outcome, reposts of this post can be rejected without a download
+    fingerprints = submission_fingerprints(task.submission)
+    if task.gallery is not None:
+        fingerprints += task.fingerprints
+    register_fingerprints(fingerprints, conf.redis_internal_ttl)
+
+    # Claims are atomic, so concurrent workers and grabbers can't both publish
+    claimed = claim_url(task.url, conf.redis_internal_ttl)
+    finish_fetch(task.url, conf.fetch_claim_ttl)
+    if not claimed:
+        return False
+
+    if phash_was_already_processed(task.phash):
+        return False
+
+    if not claim_phash(task.phash, conf.redis_internal_ttl):
+        return False
+
+    # A backfill that only seeds the dedupe stores stops at the claims
+    if conf.backfill_mode() and not conf.backfill_publish:
+        return False
+
+    return True
+
+
+def announce(
+    task: SubmissionTask,
+    conf: GrabberConfiguration,
+    published: bool,
+    digest: Optional[str] = None,
+) -> None:
+    if published and (task.gallery is None or conf.gallery_mode == "items"):
+        publish_submission(
+            GotRedditEvent.from_submission(task.submission, conf, digest, task.url)
+        )
+
+    item_done(task, conf, published, digest)
+
+
+def publish_stage(
+    task: SubmissionTask, conf: GrabberConfiguration, store: Optional[ImageStore]
+) -> Optional[SubmissionTask]:
+    published = claim_submission(task, conf)
+    # Claimed images go on to the store stage, which announces them once stored
+    if published and store is not None:
+        return task
+
+    task.content = None
+    announce(task, conf, published)
+    return None
+
+
+def store_stage(
+    task: SubmissionTask,
+    conf: GrabberConfiguration,
+    client: FetchClient,
+    store: ImageStore,
+) -> None:
+    content, task.content = task.content, None
+    digest = None
+    try:
+        # Only claimed images are worth downloading in full
+        if task.preview_url:
+            content = client.fetch_image(task.url)
+        digest = store.put(content)
+    except (FetchException, OSError, SyntaxError, ValueError) as e:
+        # Consumers fall back to the url
+        print(f"Unable to store {task.url}: {e}")
+
+    announce(task, conf, True, digest)
+
+
+def build_pipeline(conf: GrabberConfiguration) -> Pipeline:
+    client = FetchClient.from_configuration(conf)
+    pool = (
+        HashProcessPool(conf.hash_processes, conf.hash_process_max_tasks)
+        if conf.hash_processes
+        else None
+    )
+    store = (
+        ImageStore(conf.image_store_path, conf.image_store_max_bytes)
+        if conf.image_store_path
+        else None
+    )
+
+    on_error = partial(give_up, conf=conf)
+
+    def close() -> None:
+        client.close()
+        if pool is not None:
+            pool.close()
+
+    stages = [
+        Stage(
+            "fingerprint",
+            partial(fingerprint_stage, conf=conf),
+            conf.fingerprint_thread_count,
+            conf.queue_len,
+            on_error=on_error,
+        ),
+        Stage(
+            "fetch",
+            partial(fetch_stage, conf=conf, client=client),
+            conf.thread_count,
+            conf.queue_len,
+            on_error=on_error,
+        ),
+        Stage(
+            "hash",
+            partial(hash_stage, conf=conf, pool=pool),
+            conf.hash_thread_count,
+            conf.queue_len,
+            batch_size=conf.hash_batch_size,
+            on_error=on_error,
+        ),
+        Stage(
+            "publish",
+            partial(publish_stage, conf=conf, store=store),
+            conf.publish_thread_count,
+            conf.queue_len,
+            on_error=on_error,
+        ),
+    ]
+    if store is not None:
+        stages.append(
+            Stage(
+                "store",
+                partial(store_stage, conf=conf, client=client, store=store),
+                conf.store_thread_count,
+                conf.queue_len,
+                on_error=on_error,
+            )
+        )
+
+    return Pipeline(stages, on_stop=close)
@@ -0,0 +1,28 @@
+from collections import Counter
+from threading import Lock
+from typing import Dict
+
+counters: Counter = Counter()
+_lock = Lock()
+
+
+def increment(name: str, value: int = 1) -> None:
+    with _lock:
+        counters[name] += value
+
+
+def set_value(name: str, value: float) -> None:
+    with _lock:
+        counters[name] = value
+
+
+def snapshot() -> Dict[str, float]:
+    with _lock:
+        values: Dict[str, float] = dict(counters)
+
+    # Every `*_hits`/`*_misses` pair also gets its hit rate
+    for name in [n[: -len("_hits")] for n in values if n.endswith("_hits")]:
+        total = values[f"{name}_hits"] + values.get(f"{name}_misses", 0)
+        values[f"{name}_hit_rate"] = values[f"{name}_hits"] / total if total else 0.0
+
+    return values
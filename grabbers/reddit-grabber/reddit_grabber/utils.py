@@ -1,29 +1,48 @@
 import datetime
+import html
 import os
 from dataclasses import dataclass
 from datetime import timezone
 from io import BytesIO
-from pathlib import Path
-from typing import List, Optional
-
-from urllib.parse import urlparse
+from typing import List, Optional, Hashable, Set
 
 import imagehash
-import requests
 from PIL import Image
 
 from reddit_grabber.exceptions import RedditGrabberException
 
 
-class FiniteList(List):
+class BoundedSet:
+    """
+    Insertion-ordered set that forgets its oldest items once it holds `max_len`
+    of them. Items live in a fixed-size ring buffer mirrored by a set, so both
+    membership checks and evictions are O(1).
+    """
+
+    __slots__ = ("max_len", "_ring", "_items", "_position")
+
     def __init__(self, max_len: int):
-        super().__init__()
-        self.max_len = max_len
+        self.max_len: int = max(1, max_len)
+        self._ring: List[Optional[Hashable]] = [None] * self.max_len
+        self._items: Set[Hashable] = set()
+        self._position: int = 0
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._items
 
-    def append(self, item):
-        list.append(self, item)
-        if len(self) > 5:
-            del self[0]
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, item: Hashable) -> None:
+        if item in self._items:
+            return
+
+        if len(self._items) == self.max_len:
+            self._items.discard(self._ring[self._position])
+
+        self._ring[self._position] = item
+        self._items.add(item)
+        self._position = (self._position + 1) % self.max_len
 
 
 @dataclass
@@ -37,50 +56,163 @@ class GrabberConfiguration:
     redis_port: int
     redis_db: int
     redis_internal_ttl: Optional[int]
+    phash_distance: int
+    url_filter: str
+    url_filter_capacity: int
+    url_filter_error_rate: float
+    url_filter_partition_time: int
+    url_filter_partitions: int
+    url_filter_exact: bool
+    redis_cleanup_interval: int
+    urls_max_memory: int
+    phashes_max_memory: int
+    fingerprints_max_memory: int
+    dedupe_hit_bonus: int
+    cache_len: int
+    cache_miss_ttl: int
+    stats_interval: int
+    phash_index: str
+    phash_bands: int
     service_id: str
     mode: str
     post_window: int
+    page_size: int
     sleep_time: int
     thread_count: int
+    hash_thread_count: int
+    publish_thread_count: int
+    fingerprint_thread_count: int
+    store_thread_count: int
+    queue_len: int
+    fetch_pool_size: int
+    fetch_host_concurrency: int
+    fetch_connect_timeout: float
+    fetch_read_timeout: float
+    fetch_max_time: float
+    fetch_max_bytes: Optional[int]
+    fetch_max_pixels: Optional[int]
+    fetch_claim_ttl: int
+    fetch_claim_wait: int
+    hash_decode_size: int
+    hash_batch_size: int
+    preview_min_size: int
+    hash_processes: int
+    image_store_path: Optional[str]
+    image_store_max_bytes: int
+    hash_process_max_tasks: int
     post_history_cache_len: int
     mature_content_allowed: bool
+    cursor_interval: int
+    rank_top_k: int
+    rank_window: int
+    rank_max_tracked: int
+    rank_max_refreshed: int
+    api_budget: bool
+    api_rate: float
+    api_burst: int
+    gallery_mode: str
+    gallery_fetch_concurrency: int
+    backfill_listing: str
+    backfill_from: float
+    backfill_to: Optional[float]
+    backfill_publish: bool
+    sharding: bool
+    heartbeat_interval: int
+    lease_ttl: int
 
     def stream_mode(self) -> bool:
         return self.mode == "stream"
 
+    def backfill_mode(self) -> bool:
+        return self.mode == "backfill"
+
 
 def get_current_utc_timestamp() -> float:
     dt = datetime.datetime.now()
     return dt.replace(tzinfo=timezone.utc).timestamp()
 
 
+def listing_value(submission, name: str, default=None):
+    """
+    Attribute of the listing payload praw already holds, `default` if Reddit
+    didn't send it. Unlike `getattr`, a missing attribute never makes praw
+    fetch the whole submission, which costs an API request per submission.
+    """
+    value = vars(submission).get(name)
+    return default if value is None else value
+
+
 def is_image(submission) -> bool:
-    return hasattr(submission, "post_hint") and submission.post_hint == "image"
+    return listing_value(submission, "post_hint") == "image"
 
 
-def get_extension(submission) -> str:
-    return os.path.splitext(urlparse(submission.url).path)[1]
+def get_preview_url(submission, min_size: int) -> Optional[str]:
+    """
+    Url of the smallest preview rendition with both sides of at least `min_size`
+    pixels, `None` if Reddit didn't make one.
+    """
+    preview = listing_value(submission, "preview")
+    if not min_size or not preview or not preview.get("images"):
+        return None
+
+    image = preview["images"][0]
+    smallest = pick_rendition(
+        image.get("resolutions", []) + [image.get("source")], min_size
+    )
+    if not smallest:
+        return None
 
+    # Preview urls come HTML-escaped (&amp;) and are rejected as is
+    return html.unescape(smallest["url"])
 
-def download_submission(submission) -> Path:
-    ext = get_extension(submission)
-    r = requests.get(submission.url, allow_redirects=True)
 
-    with open(f"img/{submission.id}.{ext}", "wb") as f:
-        f.write(r.content)
+def pick_rendition(renditions: List[Optional[dict]], min_size: int) -> Optional[dict]:
+    large_enough = [
+        r
+        for r in renditions
+        if r
+        and r.get("url")
+        and min(r.get("width", 0), r.get("height", 0)) >= min_size
+    ]
+    if not large_enough:
+        return None
 
-    return Path(f"img/{submission.id}.{ext}")
+    return min(large_enough, key=lambda r: r["width"] * r["height"])
 
 
-def get_image(submission) -> Image.Image:
-    r = requests.get(submission.url, allow_redirects=True)
-    return Image.open(BytesIO(r.content))
+def open_image(content: bytes) -> Image.Image:
+    return Image.open(BytesIO(content))
 
 
 def get_hash(im: Image) -> imagehash.ImageHash:
     return imagehash.phash(im)
 
 
+def open_image_for_hash(content: bytes, decode_size: int) -> Image.Image:
+    # phash squashes the image to 32x32 grayscale, so there is no need to decode
+    # more than `decode_size` pixels along each axis
+    im = open_image(content)
+    width, height = im.size
+
+    if im.format == "JPEG":
+        # DCT scaling: libjpeg decodes directly at 1/2, 1/4 or 1/8 of the size
+        im.draft("L", (decode_size, decode_size))
+        return im
+
+    factor_x = max(1, width // decode_size)
+    factor_y = max(1, height // decode_size)
+    if factor_x > 1 or factor_y > 1:
+        if im.mode not in ("L", "LA", "RGB", "RGBA"):
+            im = im.convert("L")
+        im = im.reduce((factor_x, factor_y))
+
+    return im
+
+
+def get_content_hash(content: bytes, decode_size: int) -> imagehash.ImageHash:
+    return get_hash(open_image_for_hash(content, decode_size))
+
+
 def validate_mode(mode: str) -> None:
     if mode == "stream":
         return
@@ -91,8 +223,53 @@ def validate_mode(mode: str) -> None:
     if mode == "rising":
         return
 
+    if mode == "backfill":
+        return
+
+    raise RedditGrabberException(
+        f"Unknown mode {mode}. Acceptable values for RG_MODE are: stream, hot, rising, backfill"
+    )
+
+
+def validate_backfill_listing(listing: str) -> None:
+    if listing in ("top", "new"):
+        return
+
     raise RedditGrabberException(
-        f"Unknown mode {mode}. Acceptable values for RG_MODE are: stream, hot, rising"
+        f"Unknown listing {listing}. Acceptable values for RG_BACKFILL_LISTING are: top, new"
+    )
+
+
+def validate_gallery_mode(gallery_mode: str) -> None:
+    if gallery_mode in ("off", "items", "grouped"):
+        return
+
+    raise RedditGrabberException(
+        f"Unknown gallery mode {gallery_mode}. Acceptable values for RG_GALLERY_MODE are: off, items, grouped"
+    )
+
+
+def validate_url_filter(url_filter: str) -> None:
+    if url_filter == "none":
+        return
+
+    if url_filter == "bloom":
+        return
+
+    raise RedditGrabberException(
+        f"Unknown url filter {url_filter}. Acceptable values for RG_URL_FILTER are: none, bloom"
+    )
+
+
+def validate_phash_index(phash_index: str) -> None:
+    if phash_index == "local":
+        return
+
+    if phash_index == "redis":
+        return
+
+    raise RedditGrabberException(
+        f"Unknown phash index {phash_index}. Acceptable values for RG_PHASH_INDEX are: local, redis"
     )
 
 
@@ -139,15 +316,128 @@ def get_configuration() -> GrabberConfiguration:
 
     validate_mode(mode)
 
+    backfill_listing: Optional[str] = os.environ.get("RG_BACKFILL_LISTING")
+    backfill_listing: str = backfill_listing.lower() if backfill_listing else "top"
+
+    validate_backfill_listing(backfill_listing)
+
+    backfill_from: Optional[str] = os.environ.get("RG_BACKFILL_FROM")
+    backfill_from: float = float(backfill_from) if backfill_from else 0
+
+    backfill_to: Optional[str] = os.environ.get("RG_BACKFILL_TO")
+    backfill_to: Optional[float] = float(backfill_to) if backfill_to else None
+
+    backfill_publish: Optional[str] = os.environ.get("RG_BACKFILL_PUBLISH")
+    backfill_publish: bool = str_as_bool(backfill_publish) if backfill_publish else False
+
     post_limit: Optional[str] = os.environ.get("RG_POST_WINDOW")
     post_limit: int = int(post_limit) if post_limit else 100
 
+    page_size: Optional[str] = os.environ.get("RG_PAGE_SIZE")
+    page_size: int = min(100, int(page_size)) if page_size else 25
+
     sleep_time: Optional[str] = os.environ.get("RG_SLEEP_TIME")
     sleep_time: int = int(sleep_time) if sleep_time else 600
 
     thread_count: Optional[str] = os.environ.get("RG_THREAD_NUMBER")
     thread_count: int = int(thread_count) if thread_count else 4
 
+    hash_processes: Optional[str] = os.environ.get("RG_HASH_PROCESSES")
+    hash_processes: int = int(hash_processes) if hash_processes else 0
+
+    hash_process_max_tasks: Optional[str] = os.environ.get("RG_HASH_PROCESS_MAX_TASKS")
+    hash_process_max_tasks: int = int(
+        hash_process_max_tasks
+    ) if hash_process_max_tasks else 500
+
+    image_store_path: Optional[str] = os.environ.get("RG_IMAGE_STORE_PATH")
+
+    image_store_max_bytes: Optional[str] = os.environ.get("RG_IMAGE_STORE_MAX_BYTES")
+    image_store_max_bytes: int = int(
+        image_store_max_bytes
+    ) if image_store_max_bytes else 1024 * 1024 * 1024
+
+    store_thread_count: Optional[str] = os.environ.get("RG_STORE_THREAD_NUMBER")
+    store_thread_count: int = int(
+        store_thread_count
+    ) if store_thread_count else thread_count
+
+    hash_thread_count: Optional[str] = os.environ.get("RG_HASH_THREAD_NUMBER")
+    # With a process pool hash threads only feed the workers, one per process
+    hash_thread_count: int = int(hash_thread_count) if hash_thread_count else max(
+        2, hash_processes
+    )
+
+    publish_thread_count: Optional[str] = os.environ.get("RG_PUBLISH_THREAD_NUMBER")
+    publish_thread_count: int = int(
+        publish_thread_count
+    ) if publish_thread_count else 1
+
+    fingerprint_thread_count: Optional[str] = os.environ.get(
+        "RG_FINGERPRINT_THREAD_NUMBER"
+    )
+    fingerprint_thread_count: int = int(
+        fingerprint_thread_count
+    ) if fingerprint_thread_count else 1
+
+    queue_len: Optional[str] = os.environ.get("RG_QUEUE_LEN")
+    queue_len: int = int(queue_len) if queue_len else 2 * thread_count
+
+    fetch_pool_size: Optional[str] = os.environ.get("RG_FETCH_POOL_SIZE")
+    fetch_pool_size: int = int(fetch_pool_size) if fetch_pool_size else thread_count
+
+    host_concurrency: Optional[str] = os.environ.get("RG_FETCH_HOST_CONCURRENCY")
+    host_concurrency: int = int(host_concurrency) if host_concurrency else 4
+
+    connect_timeout: Optional[str] = os.environ.get("RG_FETCH_CONNECT_TIMEOUT")
+    connect_timeout: float = float(connect_timeout) if connect_timeout else 5.0
+
+    read_timeout: Optional[str] = os.environ.get("RG_FETCH_READ_TIMEOUT")
+    read_timeout: float = float(read_timeout) if read_timeout else 15.0
+
+    fetch_max_time: Optional[str] = os.environ.get("RG_FETCH_MAX_TIME")
+    fetch_max_time: float = float(fetch_max_time) if fetch_max_time else 60.0
+
+    # 0 disables the limit
+    fetch_max_bytes: Optional[str] = os.environ.get("RG_FETCH_MAX_BYTES")
+    fetch_max_bytes: Optional[int] = int(
+        fetch_max_bytes
+    ) if fetch_max_bytes else 20 * 1024 * 1024
+
+    fetch_max_pixels: Optional[str] = os.environ.get("RG_FETCH_MAX_PIXELS")
+    fetch_max_pixels: Optional[int] = int(
+        fetch_max_pixels
+    ) if fetch_max_pixels else 40_000_000
+
+    fetch_claim_ttl: Optional[str] = os.environ.get("RG_FETCH_CLAIM_TTL")
+    fetch_claim_ttl: int = int(fetch_claim_ttl) if fetch_claim_ttl else 120
+
+    fetch_claim_wait: Optional[str] = os.environ.get("RG_FETCH_CLAIM_WAIT")
+    fetch_claim_wait: int = int(fetch_claim_wait) if fetch_claim_wait else 0
+
+    hash_decode_size: Optional[str] = os.environ.get("RG_HASH_DECODE_SIZE")
+    hash_decode_size: int = max(32, int(hash_decode_size)) if hash_decode_size else 128
+
+    preview_min_size: Optional[str] = os.environ.get("RG_PREVIEW_MIN_SIZE")
+    preview_min_size: int = int(
+        preview_min_size
+    ) if preview_min_size else hash_decode_size
+
+    gallery_mode: Optional[str] = os.environ.get("RG_GALLERY_MODE")
+    gallery_mode: str = gallery_mode.lower() if gallery_mode else "items"
+
+    validate_gallery_mode(gallery_mode)
+
+    gallery_fetch_concurrency: Optional[str] = os.environ.get(
+        "RG_GALLERY_FETCH_CONCURRENCY"
+    )
+    gallery_fetch_concurrency: int = max(
+        1, int(gallery_fetch_concurrency)
+    ) if gallery_fetch_concurrency else 4
+
+    hash_batch_size: Optional[str] = os.environ.get("RG_HASH_BATCH_SIZE")
+    hash_batch_size: int = int(hash_batch_size) if hash_batch_size else 16
+
     history_cache_l: Optional[str] = os.environ.get("RG_H_CACHE_LEN")
     history_cache_l: int = int(history_cache_l) if history_cache_l else 1000
 
@@ -156,6 +446,40 @@ def get_configuration() -> GrabberConfiguration:
         mature_content_allowed
     ) if mature_content_allowed else False
 
+    api_budget: Optional[str] = os.environ.get("RG_API_BUDGET")
+    api_budget: bool = str_as_bool(api_budget) if api_budget else False
+
+    # Reddit allows 100 requests per minute for an OAuth client
+    api_rate: Optional[str] = os.environ.get("RG_API_RATE")
+    api_rate: float = float(api_rate) if api_rate else 100 / 60
+
+    api_burst: Optional[str] = os.environ.get("RG_API_BURST")
+    api_burst: int = max(1, int(api_burst)) if api_burst else 10
+
+    rank_top_k: Optional[str] = os.environ.get("RG_RANK_TOP_K")
+    rank_top_k: int = int(rank_top_k) if rank_top_k else 0
+
+    rank_window: Optional[str] = os.environ.get("RG_RANK_WINDOW")
+    rank_window: int = int(rank_window) if rank_window else 3600
+
+    rank_max_tracked: Optional[str] = os.environ.get("RG_RANK_MAX_TRACKED")
+    rank_max_tracked: int = int(rank_max_tracked) if rank_max_tracked else 10000
+
+    rank_max_refreshed: Optional[str] = os.environ.get("RG_RANK_MAX_REFRESHED")
+    rank_max_refreshed: int = int(rank_max_refreshed) if rank_max_refreshed else 300
+
+    cursor_interval: Optional[str] = os.environ.get("RG_CURSOR_INTERVAL")
+    cursor_interval: int = int(cursor_interval) if cursor_interval else 10
+
+    sharding: Optional[str] = os.environ.get("RG_SHARDING")
+    sharding: bool = str_as_bool(sharding) if sharding else False
+
+    heartbeat_interval: Optional[str] = os.environ.get("RG_HEARTBEAT_INTERVAL")
+    heartbeat_interval: int = int(heartbeat_interval) if heartbeat_interval else 10
+
+    lease_ttl: Optional[str] = os.environ.get("RG_LEASE_TTL")
+    lease_ttl: int = int(lease_ttl) if lease_ttl else 3 * heartbeat_interval
+
     redis_host: str = os.environ.get("RG_REDIS_HOST")
     redis_host = redis_host if redis_host else "localhost"
 
@@ -169,6 +493,73 @@ def get_configuration() -> GrabberConfiguration:
         redis_internal_ttl_line
     ) if redis_internal_ttl_line else None
 
+    cleanup_interval_line: str = os.environ.get("RG_REDIS_CLEANUP_INTERVAL")
+    redis_cleanup_interval: int = int(
+        cleanup_interval_line
+    ) if cleanup_interval_line else 60
+
+    urls_max_memory: Optional[str] = os.environ.get("RG_URLS_MAX_MEMORY")
+    urls_max_memory: int = int(urls_max_memory) if urls_max_memory else 0
+
+    phashes_max_memory: Optional[str] = os.environ.get("RG_PHASHES_MAX_MEMORY")
+    phashes_max_memory: int = int(phashes_max_memory) if phashes_max_memory else 0
+
+    fingerprints_max_memory: Optional[str] = os.environ.get(
+        "RG_FINGERPRINTS_MAX_MEMORY"
+    )
+    fingerprints_max_memory: int = int(
+        fingerprints_max_memory
+    ) if fingerprints_max_memory else 0
+
+    dedupe_hit_bonus: Optional[str] = os.environ.get("RG_DEDUPE_HIT_BONUS")
+    dedupe_hit_bonus: int = int(dedupe_hit_bonus) if dedupe_hit_bonus else 86400
+
+    cache_len_line: str = os.environ.get("RG_CACHE_LEN")
+    cache_len: int = int(cache_len_line) if cache_len_line else 10000
+
+    cache_miss_ttl_line: str = os.environ.get("RG_CACHE_MISS_TTL")
+    cache_miss_ttl: int = int(cache_miss_ttl_line) if cache_miss_ttl_line else 60
+
+    stats_interval_line: str = os.environ.get("RG_STATS_INTERVAL")
+    stats_interval: int = int(stats_interval_line) if stats_interval_line else 60
+
+    url_filter: Optional[str] = os.environ.get("RG_URL_FILTER")
+    url_filter: str = url_filter.lower() if url_filter else "none"
+
+    validate_url_filter(url_filter)
+
+    url_filter_capacity: Optional[str] = os.environ.get("RG_URL_FILTER_CAPACITY")
+    url_filter_capacity: int = int(
+        url_filter_capacity
+    ) if url_filter_capacity else 1_000_000
+
+    url_filter_error_rate: Optional[str] = os.environ.get("RG_URL_FILTER_ERROR_RATE")
+    url_filter_error_rate: float = float(
+        url_filter_error_rate
+    ) if url_filter_error_rate else 0.001
+
+    partition_time: Optional[str] = os.environ.get("RG_URL_FILTER_PARTITION_TIME")
+    partition_time: int = int(partition_time) if partition_time else 7 * 24 * 3600
+
+    url_filter_partitions: Optional[str] = os.environ.get("RG_URL_FILTER_PARTITIONS")
+    url_filter_partitions: int = int(
+        url_filter_partitions
+    ) if url_filter_partitions else 13
+
+    url_filter_exact: Optional[str] = os.environ.get("RG_URL_FILTER_EXACT")
+    url_filter_exact: bool = str_as_bool(url_filter_exact) if url_filter_exact else False
+
+    phash_distance_line: str = os.environ.get("RG_PHASH_DISTANCE")
+    phash_distance: int = int(phash_distance_line) if phash_distance_line else 0
+
+    phash_index: Optional[str] = os.environ.get("RG_PHASH_INDEX")
+    phash_index: str = phash_index.lower() if phash_index else "local"
+
+    validate_phash_index(phash_index)
+
+    phash_bands_line: str = os.environ.get("RG_PHASH_BANDS")
+    phash_bands: int = int(phash_bands_line) if phash_bands_line else 4
+
     return GrabberConfiguration(
         client_id=client_id,
         client_secret=client_secret,
@@ -180,10 +571,66 @@ def get_configuration() -> GrabberConfiguration:
         redis_host=redis_host,
         service_id=rg_id,
         redis_internal_ttl=redis_internal_ttl,
+        phash_distance=phash_distance,
+        url_filter=url_filter,
+        url_filter_capacity=url_filter_capacity,
+        url_filter_error_rate=url_filter_error_rate,
+        url_filter_partition_time=partition_time,
+        url_filter_partitions=url_filter_partitions,
+        url_filter_exact=url_filter_exact,
+        redis_cleanup_interval=redis_cleanup_interval,
+        urls_max_memory=urls_max_memory,
+        phashes_max_memory=phashes_max_memory,
+        fingerprints_max_memory=fingerprints_max_memory,
+        dedupe_hit_bonus=dedupe_hit_bonus,
+        cache_len=cache_len,
+        cache_miss_ttl=cache_miss_ttl,
+        stats_interval=stats_interval,
+        phash_index=phash_index,
+        phash_bands=phash_bands,
         mode=mode,
         sleep_time=sleep_time,
         post_window=post_limit,
+        page_size=page_size,
         thread_count=thread_count,
+        hash_thread_count=hash_thread_count,
+        publish_thread_count=publish_thread_count,
+        fingerprint_thread_count=fingerprint_thread_count,
+        store_thread_count=store_thread_count,
+        queue_len=queue_len,
+        fetch_pool_size=fetch_pool_size,
+        fetch_host_concurrency=host_concurrency,
+        fetch_connect_timeout=connect_timeout,
+        fetch_read_timeout=read_timeout,
+        fetch_max_time=fetch_max_time,
+        fetch_max_bytes=fetch_max_bytes,
+        fetch_max_pixels=fetch_max_pixels,
+        fetch_claim_ttl=fetch_claim_ttl,
+        fetch_claim_wait=fetch_claim_wait,
+        hash_decode_size=hash_decode_size,
+        hash_batch_size=hash_batch_size,
+        preview_min_size=preview_min_size,
+        hash_processes=hash_processes,
+        image_store_path=image_store_path,
+        image_store_max_bytes=image_store_max_bytes,
+        hash_process_max_tasks=hash_process_max_tasks,
         post_history_cache_len=history_cache_l,
         mature_content_allowed=mature_content_allowed,
+        cursor_interval=cursor_interval,
+        rank_top_k=rank_top_k,
+        rank_window=rank_window,
+        rank_max_tracked=rank_max_tracked,
+        rank_max_refreshed=rank_max_refreshed,
+        api_budget=api_budget,
+        api_rate=api_rate,
+        api_burst=api_burst,
+        gallery_mode=gallery_mode,
+        gallery_fetch_concurrency=gallery_fetch_concurrency,
+        backfill_listing=backfill_listing,
+        backfill_from=backfill_from,
+        backfill_to=backfill_to,
+        backfill_publish=backfill_publish,
+        sharding=sharding,
+        heartbeat_interval=heartbeat_interval,
+        lease_ttl=lease_ttl,
     )
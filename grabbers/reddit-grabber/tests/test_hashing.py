@@ -0,0 +1,37 @@
+import random
+from io import BytesIO
+
+import imagehash
+from PIL import Image, ImageDraw
+
+from reddit_grabber.hashing import batch_phash
+
+
+def make_image(seed: int, mode: str) -> Image.Image:
+    rng = random.Random(seed)
+    size = (rng.randrange(16, 300), rng.randrange(16, 300))
+    im = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(8):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse(
+            [x, y, x + rng.randrange(size[0]), y + rng.randrange(size[1])],
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+    # Re-encoding adds JPEG noise, so hashes aren't all trivially alike
+    buffer = BytesIO()
+    im.save(buffer, "JPEG", quality=rng.randrange(30, 95))
+    return Image.open(BytesIO(buffer.getvalue())).convert(mode)
+
+
+def test_batch_phash_is_bit_identical():
+    images = [make_image(i, mode) for i in range(60) for mode in ("RGB", "L", "P")]
+
+    assert batch_phash(images) == [imagehash.phash(im) for im in images]
+    assert [str(h) for h in batch_phash(images[:1])] == [
+        str(imagehash.phash(images[0]))
+    ]
+
+
+def test_batch_phash_empty():
+    assert batch_phash([]) == []
@@ -0,0 +1,153 @@
+from types import SimpleNamespace
+
+import praw
+import pytest
+from praw.models import Submission
+from prawcore import Requestor
+
+from reddit_grabber.events import GotRedditEvent
+from reddit_grabber.fingerprints import lookup_fingerprints
+from reddit_grabber.stages import accept_submission
+
+
+class RequestMade(Exception):
+    pass
+
+
+class CountingRequestor(Requestor):
+    """Counts HTTP calls instead of making them."""
+
+    calls = 0
+
+    def request(self, *args, **kwargs):
+        CountingRequestor.calls += 1
+        raise RequestMade(args, kwargs)
+
+
+# What a `new` listing returns for an image post, minus the fields the grabber
+# has no use for. Optional fields like `downs` or `is_original_content` are
+# missing on purpose: Reddit leaves them out of some payloads.
+listing_payload = {
+    "id": "1abcde",
+    "name": "t3_1abcde",
+    "url": "https://i.redd.it/x7fa2k9c3ud91.jpg",
+    "post_hint": "image",
+    "over_18": False,
+    "ups": 42,
+    "created_utc": 1700000000.0,
+    "title": "Roll for initiative",
+    "author": "someone",
+    "subreddit": "dndmemes",
+    "subreddit_name_prefixed": "r/dndmemes",
+    "preview": {
+        "images": [
+            {
+                "id": "preview-id",
+                "source": {
+                    "url": "https://preview.redd.it/a.jpg",
+                    "width": 1080,
+                    "height": 1350,
+                },
+                "resolutions": [
+                    {
+                        "url": "https://preview.redd.it/a.jpg?width=640&amp;s=1",
+                        "width": 640,
+                        "height": 800,
+                    }
+                ],
+            }
+        ]
+    },
+}
+
+
+def gallery_media(media_id: str, kind: str = "Image") -> dict:
+    url = f"https://preview.redd.it/{media_id}.jpg?width={{}}&amp;s=1"
+    return {
+        "status": "valid",
+        "e": kind,
+        "m": "image/jpeg",
+        "p": [{"x": w, "y": w, "u": url.format(w)} for w in (108, 320, 640)],
+        "s": {"x": 1080, "y": 1080, "u": url.format(1080)},
+    }
+
+
+gallery_payload = {
+    **listing_payload,
+    "url": "https://www.reddit.com/gallery/1abcde",
+    "is_gallery": True,
+    "gallery_data": {
+        "items": [{"media_id": "first"}, {"media_id": "gif"}, {"media_id": "second"}]
+    },
+    "media_metadata": {
+        "second": gallery_media("second"),
+        "first": gallery_media("first"),
+        "gif": gallery_media("gif", "AnimatedImage"),
+    },
+}
+del gallery_payload["post_hint"]
+del gallery_payload["preview"]
+
+
+def make_submission(payload: dict) -> Submission:
+    reddit = praw.Reddit(
+        client_id="id",
+        client_secret="secret",
+        user_agent="tests",
+        requestor_class=CountingRequestor,
+    )
+    CountingRequestor.calls = 0
+    return Submission(reddit, _data=dict(payload))
+
+
+@pytest.fixture
+def submission():
+    return make_submission(listing_payload)
+
+
+def test_missing_attribute_is_fetched(submission):
+    # Makes sure the harness sees praw's lazy fetches at all
+    with pytest.raises(RequestMade):
+        submission.downs
+    assert CountingRequestor.calls == 1
+
+
+def test_event_is_built_without_requests(submission):
+    conf = SimpleNamespace(
+        tags=["memes"],
+        service_id="grabber",
+        mature_content_allowed=False,
+        preview_min_size=320,
+        gallery_mode="items",
+    )
+
+    task = accept_submission(submission, conf)
+    lookup_fingerprints(submission)
+    event = GotRedditEvent.from_submission(submission, conf, digest="digest")
+
+    assert CountingRequestor.calls == 0
+    assert task is not None and task.url == listing_payload["url"]
+    assert task.preview_url == "https://preview.redd.it/a.jpg?width=640&s=1"
+    assert event.downs is None
+    assert event.is_original_content is False
+    assert event.author == "someone"
+    assert event.shortlink.endswith("/1abcde")
+
+
+def test_gallery_is_expanded_without_requests():
+    conf = SimpleNamespace(
+        mature_content_allowed=False, preview_min_size=320, gallery_mode="items"
+    )
+
+    task = accept_submission(make_submission(gallery_payload), conf)
+
+    assert CountingRequestor.calls == 0
+    # Animated items are left out, the rest keep the gallery order
+    assert [item.url for item in task.items] == [
+        "https://i.redd.it/first.jpg",
+        "https://i.redd.it/second.jpg",
+    ]
+    preview_url = "https://preview.redd.it/second.jpg?width=320&s=1"
+    assert task.items[1].preview_url == preview_url
+    assert task.items[1].fingerprints == ["media:second"]
+    assert task.items[0].gallery is task.items[1].gallery
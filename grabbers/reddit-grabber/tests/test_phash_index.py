@@ -0,0 +1,117 @@
+import random
+
+import fakeredis
+import pytest
+
+from reddit_grabber.phash_index import (
+    PhashIndex,
+    RedisPhashIndex,
+    hamming_distance,
+    phash_to_str,
+)
+
+max_distance = 6
+
+
+def flip_bits(h: int, bits: int, rng: random.Random) -> int:
+    for position in rng.sample(range(64), bits):
+        h ^= 1 << position
+    return h
+
+
+def make_hashes(seed: int):
+    """
+    Stored hashes and queries: near duplicates of stored hashes on both sides
+    of `max_distance`, and unrelated hashes.
+    """
+    rng = random.Random(seed)
+    stored = [rng.getrandbits(64) for _ in range(300)]
+    queries = [rng.getrandbits(64) for _ in range(100)]
+    for h in rng.sample(stored, 100):
+        queries.append(flip_bits(h, rng.randrange(max_distance + 3), rng))
+    return stored, queries
+
+
+def brute_force(stored, h: int) -> bool:
+    return any(hamming_distance(h, s) <= max_distance for s in stored)
+
+
+def check_against_brute_force(index, stored, queries, now: float) -> None:
+    for h in queries:
+        found = index.find(h, now)
+        assert (found is not None) == brute_force(stored, h)
+        if found is not None:
+            assert found in stored
+            assert hamming_distance(h, found) <= max_distance
+
+
+@pytest.mark.parametrize("chunks", [2, 3, 4, 7])
+def test_finds_the_same_as_brute_force(chunks):
+    stored, queries = make_hashes(chunks)
+    index = PhashIndex(max_distance, chunks)
+    for h in stored:
+        index.add(h)
+
+    assert len(index) == len(stored)
+    check_against_brute_force(index, stored, queries, now=0)
+
+
+def test_expired_hashes_are_not_found():
+    first, second = 0, (1 << 64) - 1
+    index = PhashIndex(max_distance)
+    index.add(first, expire=10)
+    index.add(second, expire=20)
+    # A later expiration wins over the one already stored
+    index.add(second, expire=30)
+    index.add(second, expire=15)
+
+    assert index.find(first, now=5) == first
+    assert index.find(first, now=10) is None
+    assert index.find(second, now=25) == second
+    assert index.find(second, now=30) is None
+    assert len(index) == 0
+
+
+def test_removed_hashes_are_not_found():
+    index = PhashIndex(max_distance)
+    index.add(0b1011)
+    index.remove([0b1011, 0b1])
+
+    assert index.find(0b1011, now=0) is None
+    assert len(index) == 0
+
+
+def test_redis_index_finds_the_same_as_brute_force():
+    stored, queries = make_hashes(42)
+    # More bands than bits of distance, so no near duplicate is missed
+    index = RedisPhashIndex(
+        fakeredis.FakeStrictRedis(), "bands", max_distance, max_distance + 1, lambda: 0
+    )
+    for h in stored:
+        index.add(h)
+
+    check_against_brute_force(index, stored, queries, now=0)
+
+
+def test_redis_index_drops_expired_hashes():
+    connection = fakeredis.FakeStrictRedis()
+    # Buckets expire at real timestamps
+    now = [2_000_000_000]
+    index = RedisPhashIndex(connection, "bands", max_distance, 4, lambda: now[0])
+    first, second = 0, (1 << 64) - 1
+
+    index.add(first, expire=now[0] + 100)
+    index.add(second, expire=now[0] + 300)
+    assert index.find(first, now=now[0] + 50) == first
+    assert index.find(first, now=now[0] + 100) is None
+
+    # The next add to a bucket trims what has expired there
+    now[0] += 200
+    index.add(first | 1, expire=now[0] + 100)
+    shared = set(index.bucket_keys(first)) & set(index.bucket_keys(first | 1))
+    assert shared
+    for key in shared:
+        assert connection.zscore(key, phash_to_str(first)) is None
+
+    index.remove([second])
+    assert index.find(second, now=now[0]) is None
@@ -0,0 +1,102 @@
+import random
+import statistics
+from io import BytesIO
+from types import SimpleNamespace
+
+from PIL import Image, ImageDraw
+
+from reddit_grabber.hashing import hash_contents
+from reddit_grabber.phash_index import hamming_distance, phash_to_int
+from reddit_grabber.utils import get_preview_url
+
+# Widths of the renditions Reddit lists in `preview.images[].resolutions`
+rendition_widths = [108, 216, 320, 640, 960]
+decode_size = 128
+
+
+def make_meme(seed: int):
+    rng = random.Random(seed)
+    width, height = rng.choice(
+        [(1080, 1350), (1920, 1080), (1200, 1200), (800, 2000), (3000, 2000)]
+    )
+    im = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(im)
+    for _ in range(rng.randrange(5, 40)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.ellipse(
+            [x, y, x + rng.randrange(width // 2), y + rng.randrange(height // 2)],
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+    for _ in range(rng.randrange(4)):
+        # Caption bars
+        y = rng.randrange(height)
+        draw.rectangle([0, y, width, min(height, y + 60)], fill=(255, 255, 255))
+        draw.text((rng.randrange(width // 2), y + 20), "ROLL FOR INITIATIVE", fill=0)
+
+    buffer = BytesIO()
+    im.save(buffer, rng.choice(["JPEG", "PNG"]))
+    return im, buffer.getvalue()
+
+
+def make_rendition(im: Image.Image, width: int) -> bytes:
+    height = round(im.height * width / im.width)
+    buffer = BytesIO()
+    im.resize((width, height), Image.LANCZOS).save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def test_preview_hash_calibration():
+    """
+    Hamming distance between the phash of a preview rendition and the phash
+    of its original. Run with `-s` to see the distribution.
+    """
+    memes = [make_meme(seed) for seed in range(16)]
+    originals = hash_contents([content for _, content in memes], decode_size)
+
+    for width in rendition_widths:
+        previews = hash_contents(
+            [make_rendition(im, width) for im, _ in memes], decode_size
+        )
+        distances = [
+            hamming_distance(phash_to_int(a), phash_to_int(b))
+            for a, b in zip(originals, previews)
+        ]
+        print(
+            f"width {width:>4}: mean {statistics.mean(distances):.2f}, "
+            f"max {max(distances)}"
+        )
+
+        assert statistics.mean(distances) <= 2
+        assert max(distances) <= 8
+
+
+def test_get_preview_url():
+    def rendition(width, height):
+        url = f"https://preview.redd.it/a.jpg?width={width}&amp;s=x"
+        return {"url": url, "width": width, "height": height}
+
+    submission = SimpleNamespace(
+        preview={
+            "images": [
+                {
+                    "source": rendition(1920, 1080),
+                    "resolutions": [
+                        rendition(108, 60),
+                        rendition(216, 121),
+                        rendition(320, 180),
+                        rendition(640, 360),
+                    ],
+                }
+            ]
+        }
+    )
+
+    assert get_preview_url(submission, 128) == (
+        "https://preview.redd.it/a.jpg?width=320&s=x"
+    )
+    assert get_preview_url(submission, 1000) == (
+        "https://preview.redd.it/a.jpg?width=1920&s=x"
+    )
+    assert get_preview_url(submission, 2000) is None
+    assert get_preview_url(submission, 0) is None
+    assert get_preview_url(SimpleNamespace(), 128) is None
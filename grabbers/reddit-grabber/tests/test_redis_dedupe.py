@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+import redis
+
+from reddit_grabber import redis_utils
+from reddit_grabber.bloom import RotatingBloomFilter
+from reddit_grabber.cursors import StreamCursor
+from reddit_grabber.phash_index import RedisPhashIndex, phash_to_int, phash_to_str
+from reddit_grabber.retention import MemoryBudget
+
+state = [
+    "connection",
+    "phash_index",
+    "url_filter",
+    "url_cache",
+    "phash_cache",
+    "url_budget",
+    "phash_budget",
+    "fingerprint_budget",
+    "last_cleanup",
+]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Some keys expire at these timestamps, so they have to be in the future
+    now = SimpleNamespace(time=2_000_000_000.0)
+    monkeypatch.setattr(redis_utils, "get_current_utc_timestamp", lambda: now.time)
+    return now
+
+
+@pytest.fixture
+def connect(monkeypatch, clock):
+    def connect(**overrides):
+        server = fakeredis.FakeServer()
+        monkeypatch.setattr(
+            redis,
+            "StrictRedis",
+            lambda **kwargs: fakeredis.FakeStrictRedis(server=server),
+        )
+        for name in state:
+            monkeypatch.setattr(redis_utils, name, getattr(redis_utils, name))
+        monkeypatch.setattr(redis_utils, "connection", None)
+
+        config = dict(
+            redis_host="localhost",
+            redis_port=6379,
+            redis_db=0,
+            redis_cleanup_interval=60,
+            urls_max_memory=0,
+            phashes_max_memory=0,
+            fingerprints_max_memory=0,
+            dedupe_hit_bonus=0,
+            url_filter="none",
+            cache_len=0,
+            phash_distance=0,
+        )
+        config.update(overrides)
+        redis_utils.connect_to_redis(SimpleNamespace(**config))
+        return redis_utils.connection
+
+    return connect
+
+
+@pytest.fixture
+def connection(connect):
+    return connect()
+
+
+def test_url_is_claimed_once(connection):
+    assert redis_utils.claim_url("https://i.redd.it/a.jpg", 60)
+    assert not redis_utils.claim_url("https://i.redd.it/a.jpg", 60)
+    assert redis_utils.url_was_already_processed("https://i.redd.it/a.jpg")
+    assert not redis_utils.url_was_already_processed("https://i.redd.it/b.jpg")
+
+
+def test_concurrent_claims_have_one_winner(connection):
+    with ThreadPoolExecutor(8) as executor:
+        claims = list(
+            executor.map(lambda _: redis_utils.claim_phash("f0" * 8, 60), range(32))
+        )
+
+    assert claims.count(True) == 1
+
+
+def test_expired_url_can_be_claimed_again(connection, clock):
+    assert redis_utils.claim_url("https://i.redd.it/a.jpg", 60)
+
+    clock.time += 60
+    assert not redis_utils.url_was_already_processed("https://i.redd.it/a.jpg")
+    assert redis_utils.claim_url("https://i.redd.it/a.jpg", 60)
+
+
+def test_evicted_phashes_leave_the_band_buckets(connect, clock, monkeypatch):
+    connection = connect(
+        phashes_max_memory=20 * 150,
+        phash_distance=4,
+        phash_index="redis",
+        phash_bands=5,
+    )
+    # fakeredis has no MEMORY USAGE: entries take 100 bytes, their buckets 50
+    sampled = []
+
+    def store_usage(budget, entries):
+        return 100 * entries + budget.companion_usage(entries)
+
+    def bucket_usage(index, sample, entries):
+        sampled.extend(sample)
+        return 50 * entries
+
+    monkeypatch.setattr(MemoryBudget, "memory_usage", store_usage)
+    monkeypatch.setattr(RedisPhashIndex, "memory_usage", bucket_usage)
+
+    phashes = [f"{i:02x}" * 8 for i in range(0, 240, 8)]
+    for phash in phashes:
+        assert redis_utils.claim_phash(phash, 3600)
+
+    sampled.clear()
+    clock.time += 60
+    redis_utils.phash_was_already_processed(phashes[0])
+
+    kept = {m.decode() for m in connection.zrange(redis_utils.phash_db, 0, -1)}
+    # Evictions go down to 90% of the budget
+    assert len(kept) == 18
+    assert 0 < len(sampled) <= redis_utils.band_memory_sample
+    assert {phash_to_str(h) for h in sampled} <= set(phashes)
+    for phash in phashes:
+        found = redis_utils.phash_index.find(phash_to_int(phash), clock.time)
+        assert (found is not None) == (phash in kept)
+
+
+def test_fetch_claim_is_released_by_its_owner_only(connection):
+    url = "https://i.redd.it/a.jpg"
+    assert redis_utils.claim_fetch(url, "first", 60)
+    assert not redis_utils.claim_fetch(url, "second", 60)
+
+    redis_utils.release_fetch(url, "second")
+    assert redis_utils.get_fetch_claim(url) == "first"
+    redis_utils.release_fetch(url, "first")
+    assert redis_utils.claim_fetch(url, "second", 60)
+
+    # A finished download isn't anybody's to release anymore
+    redis_utils.finish_fetch(url, 60)
+    redis_utils.release_fetch(url, "second")
+    assert redis_utils.get_fetch_claim(url) == redis_utils.fetch_done
+
+
+def test_bloom_filter_forgets_items_after_its_partitions_rotate():
+    connection = fakeredis.FakeStrictRedis()
+    bloom = RotatingBloomFilter(
+        connection, "bf", capacity=100, error_rate=0.01, partition_time=10, partitions=3
+    )
+    # Partitions expire at real timestamps
+    start = 2_000_000_000
+
+    assert bloom.claim("a", now=start)
+    assert not bloom.claim("a", now=start + 5)
+    bloom.add("b", now=start + 15)
+
+    assert bloom.contains("a", now=start + 29)
+    assert not bloom.contains("a", now=start + 30)
+    assert bloom.contains("b", now=start + 39)
+    assert bloom.claim("a", now=start + 30)
+    # A partition lives as long as the periods that look it up
+    partition = bloom.current_partition(start)
+    assert connection.ttl(bloom.partition_key(partition)) > 0
+
+
+def test_bloom_filter_never_misses_an_added_item():
+    bloom = RotatingBloomFilter(
+        fakeredis.FakeStrictRedis(),
+        "bf",
+        capacity=200,
+        error_rate=0.01,
+        partition_time=10,
+        partitions=2,
+    )
+    start = 2_000_000_000
+    items = [f"https://i.redd.it/{i}.jpg" for i in range(200)]
+    for i, item in enumerate(items):
+        bloom.add(item, now=start + i % 20)
+
+    assert all(bloom.contains(item, now=start + 19) for item in items)
+
+
+def test_cursor_stops_below_submissions_in_flight():
+    connection = fakeredis.FakeStrictRedis()
+    cursor = StreamCursor(connection, interval=0)
+    cursor.load("memes+DnDMemes")
+
+    first = cursor.advance(SimpleNamespace(id="1abc01"))
+    second = cursor.advance(SimpleNamespace(id="1abc02"))
+    third = cursor.advance(SimpleNamespace(id="1abc03"))
+    second()
+    third()
+    cursor.flush()
+
+    # A restart replays what the pipeline didn't finish, in any spelling
+    restarted = StreamCursor(connection, interval=0)
+    restarted.load("dndmemes+memes")
+    assert not restarted.is_new(SimpleNamespace(id="1abc00"))
+    assert restarted.is_new(SimpleNamespace(id="1abc01"))
+
+    first()
+    cursor.flush()
+    restarted.load("dndmemes+memes")
+    assert not restarted.is_new(SimpleNamespace(id="1abc03"))
+    assert restarted.is_new(SimpleNamespace(id="1abc04"))
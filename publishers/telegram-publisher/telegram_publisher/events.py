@@ -1,5 +1,5 @@
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, List, Dict, Any
 
 
@@ -15,8 +15,10 @@ class ApprovedEvent:
         original_tags: Optional[List[str]] = None,
         source: Optional[str] = None,
         version: Optional[str] = None,
+        digest: Optional[str] = None,
     ) -> None:
         self.tags: Optional[List[str]] = tags
+        self.digest: Optional[str] = digest
         self.original_tags: Optional[List[str]] = original_tags
         self.url: Optional[str] = url
         self.up: Optional[int] = up
@@ -30,6 +32,14 @@ class ApprovedEvent:
     def description(self) -> str:
         return ""
 
+    @property
+    def urls(self) -> List[str]:
+        return [self.url]
+
+    @property
+    def digests(self) -> List[Optional[str]]:
+        return [self.digest]
+
     @property
     def all_tags(self) -> List[str]:
         t = [] if not self.tags else self.tags
@@ -70,6 +80,10 @@ class RedditDetails:
     ups: Optional[int] = None
     downs: Optional[int] = None
     version: Optional[str] = None
+    digest: Optional[str] = None
+    # Every image of a gallery, the first one is also in `url` and `digest`
+    urls: List[str] = field(default_factory=list)
+    digests: List[Optional[str]] = field(default_factory=list)
 
     @staticmethod
     def from_str(rs: str) -> "RedditDetails":
@@ -88,6 +102,9 @@ class RedditDetails:
             ups=d.get("ups"),
             downs=d.get("downs"),
             version=d.get("version"),
+            digest=d.get("digest"),
+            urls=d.get("urls") if d.get("urls") else [],
+            digests=d.get("digests") if d.get("digests") else [],
         )
 
 
@@ -114,10 +131,22 @@ class ApprovedRedditEvent(ApprovedEvent):
             type=type,
             source=source,
             version=version,
+            digest=reddit_details.digest,
         )
 
         self.reddit_details = reddit_details
 
+    @property
+    def urls(self) -> List[str]:
+        return self.reddit_details.urls or [self.url]
+
+    @property
+    def digests(self) -> List[Optional[str]]:
+        if not self.reddit_details.urls:
+            return [self.digest]
+        digests = self.reddit_details.digests
+        return digests if digests else [None] * len(self.reddit_details.urls)
+
     @property
     def description(self) -> str:
         striped_title = self.reddit_details.title.strip()
@@ -151,7 +180,7 @@ class ApprovedRedditEvent(ApprovedEvent):
 
 def get_event_from_dict(d: Dict) -> ApprovedEvent:
     or_d = json.loads(d["original_event"])
-    if or_d["type"] == "Got_Reddit_Submission":
+    if or_d["type"] in ("Got_Reddit_Submission", "Got_Reddit_Gallery"):
         return ApprovedRedditEvent.from_dict(d)
     else:
         return ApprovedEvent.from_dict(d)
@@ -5,6 +5,7 @@ from typing import Dict
 from aiogram import Bot, Dispatcher
 
 from telegram_publisher.events import get_event_from_string
+from telegram_publisher.image_store import get_albums, get_stored_image
 from telegram_publisher.redis_utils import (
     connect_to_redis,
     subscribe_to_voter_events,
@@ -50,15 +51,24 @@ async def publish_memes():
 
                     await asyncio.sleep(delay)
 
-                await bot.send_photo(
-                    config.target_channel,
-                    event.url,
-                    caption=event.description if config.with_description else None,
-                    parse_mode="Markdown",
-                )
+                caption = event.description if config.with_description else None
+                if len(event.urls) > 1:
+                    for album in get_albums(
+                        config.image_store_path, event.urls, event.digests, caption
+                    ):
+                        await bot.send_media_group(config.target_channel, album)
+                else:
+                    photo = get_stored_image(config.image_store_path, event.digest)
+                    await bot.send_photo(
+                        config.target_channel,
+                        photo if photo is not None else event.url,
+                        caption=caption,
+                        parse_mode="Markdown",
+                    )
 
                 trim_queue(config.max_queue_len)
-                cache_url(event.url, config.redis_internal_ttl)
+                for url in event.urls:
+                    cache_url(url, config.redis_internal_ttl)
             except Exception as e:
                 print(e)
                 pass
@@ -5,12 +5,17 @@ import redis
 from redis import StrictRedis
 
 from telegram_publisher.events import get_event_from_string
+from telegram_publisher.retention import MemoryBudget
 from telegram_publisher.exceptions import TelegramPublisherException
 from telegram_publisher.utils import PublisherConfiguration, get_current_utc_timestamp
 
 url_db: Optional[str] = None
 vt_events = "voters.events"
 connection: Optional[StrictRedis] = None
+url_budget: Optional[MemoryBudget] = None
+
+cleanup_interval: int = 60
+last_cleanup: int = 0
 
 events_to_process_queue: Optional[str] = None
 
@@ -19,6 +24,7 @@ def connect_to_redis(config: PublisherConfiguration) -> None:
     global connection
     global url_db
     global events_to_process_queue
+    global url_budget
     if connection is not None:
         return
 
@@ -29,6 +35,12 @@ def connect_to_redis(config: PublisherConfiguration) -> None:
         host=config.redis_host, port=config.redis_port, db=config.redis_db
     )
 
+    if config.url_db_max_memory:
+        url_budget = MemoryBudget(
+            connection, url_db, config.url_db_max_memory, config.dedupe_hit_bonus
+        )
+        url_budget.seed()
+
 
 def remove_expired_values(func: Callable) -> Callable:
     def func_wrapper(*args, **kwargs):
@@ -37,13 +49,25 @@ def remove_expired_values(func: Callable) -> Callable:
         if not connection:
             raise TelegramPublisherException("There is no connection to Redis")
         current_time = int(get_current_utc_timestamp())
-        connection.zremrangebyscore(url_db, "-inf", current_time)
+        if url_budget is None:
+            connection.zremrangebyscore(url_db, "-inf", current_time)
+        else:
+            cleanup_budget(current_time)
 
         return res
 
     return func_wrapper
 
 
+def cleanup_budget(current_time: int) -> None:
+    global last_cleanup
+    # Measuring memory is too costly to do on every call
+    if current_time - last_cleanup < cleanup_interval:
+        return
+    last_cleanup = current_time
+    url_budget.cleanup(current_time)
+
+
 def subscribe(channel: str, handler: Callable) -> Thread:
     if not connection:
         raise TelegramPublisherException("There is no connection to Redis")
@@ -80,6 +104,8 @@ def cache_url(url: str, ttl: Optional[int]) -> None:
         get_current_utc_timestamp() + ttl
     ) if ttl else "+inf"
     connection.zadd(url_db, {url: expire_time})
+    if url_budget is not None:
+        url_budget.added([url], get_current_utc_timestamp())
 
 
 @remove_expired_values
@@ -98,4 +124,8 @@ def url_was_already_processed(url: Optional[str]) -> bool:
     if not url:
         return False
 
-    return connection.zscore(url_db, url) is not None
+    processed = connection.zscore(url_db, url) is not None
+    if processed and url_budget is not None:
+        url_budget.hit(url)
+
+    return processed
@@ -0,0 +1,101 @@
+import math
+from typing import Iterable
+
+from redis import StrictRedis
+
+# KEYS[1]: dedupe store, KEYS[2]: its value set. Drops the ARGV[1] least
+# valuable entries from both.
+evict_script = """
+local popped = redis.call('ZPOPMIN', KEYS[2], ARGV[1])
+local evicted = 0
+for i = 1, #popped, 2 do
+    evicted = evicted + redis.call('ZREM', KEYS[1], popped[i])
+end
+return evicted
+"""
+
+# Removes up to ARGV[2] entries that expired by ARGV[1] from both sets
+remove_expired_script = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for i = 1, #expired do
+    redis.call('ZREM', KEYS[1], expired[i])
+    redis.call('ZREM', KEYS[2], expired[i])
+end
+return #expired
+"""
+
+expired_batch = 1000
+
+
+class MemoryBudget:
+    """
+    Keeps a dedupe SortedSet (scored by expiration time) under `max_bytes` of
+    Redis memory.
+
+    Every entry's value is kept in the `{key}_value` SortedSet: the time it was
+    added plus `hit_bonus` seconds for each time it caught a duplicate. When
+    the store outgrows its budget, the entries with the lowest value, i.e. the
+    oldest and least often hit ones, are evicted first. Hits, evictions and
+    memory usage are written to the `{key}_stats` Hash.
+    """
+
+    def __init__(
+        self, connection: StrictRedis, key: str, max_bytes: int, hit_bonus: int
+    ) -> None:
+        self.connection: StrictRedis = connection
+        self.key: str = key
+        self.value_key: str = f"{key}_value"
+        self.stats_key: str = f"{key}_stats"
+        self.max_bytes: int = max_bytes
+        self.hit_bonus: int = hit_bonus
+        self._evict = connection.register_script(evict_script)
+        self._remove_expired = connection.register_script(remove_expired_script)
+
+    def seed(self) -> None:
+        # Entries stored before the budget was enabled start with the lowest value
+        if not self.connection.exists(self.value_key):
+            self.connection.zunionstore(self.value_key, {self.key: 0})
+
+    def added(self, members: Iterable[str], current_time: float) -> None:
+        mapping = {m: current_time for m in members}
+        if mapping:
+            pipe = self.connection.pipeline(transaction=False)
+            pipe.zadd(self.value_key, mapping)
+            pipe.hincrby(self.stats_key, "misses", len(mapping))
+            pipe.execute()
+
+    def hit(self, member: str) -> None:
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.zincrby(self.value_key, self.hit_bonus, member)
+        pipe.hincrby(self.stats_key, "hits", 1)
+        pipe.execute()
+
+    def memory_usage(self) -> int:
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.memory_usage(self.key)
+        pipe.memory_usage(self.value_key)
+        return sum(usage or 0 for usage in pipe.execute())
+
+    def cleanup(self, current_time: float) -> None:
+        while (
+            self._remove_expired(
+                keys=[self.key, self.value_key], args=[current_time, expired_batch]
+            )
+            == expired_batch
+        ):
+            pass
+
+        usage = self.memory_usage()
+        self.connection.hset(self.stats_key, "memory", usage)
+        if usage <= self.max_bytes:
+            return
+
+        entries = self.connection.zcard(self.key)
+        if not entries:
+            return
+
+        # Going down to 90% spares an eviction round on every cleanup
+        per_entry = usage / entries
+        count = math.ceil((usage - self.max_bytes * 0.9) / per_entry)
+        evicted = self._evict(keys=[self.key, self.value_key], args=[count])
+        self.connection.hincrby(self.stats_key, "evictions", evicted)
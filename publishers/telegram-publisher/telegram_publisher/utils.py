@@ -32,6 +32,9 @@ class PublisherConfiguration:
     max_queue_len: Optional[int]
     max_delay: Optional[int]
     min_delay: Optional[int]
+    image_store_path: Optional[str]
+    url_db_max_memory: int
+    dedupe_hit_bonus: int
 
 
 def get_configuration() -> PublisherConfiguration:
@@ -95,6 +98,14 @@ def get_configuration() -> PublisherConfiguration:
     max_queue_len: Optional[str] = os.environ.get("TP_MAX_QUEUE_LEN")
     max_queue_len: Optional[int] = int(max_queue_len) if max_queue_len else None
 
+    image_store_path: Optional[str] = os.environ.get("TP_IMAGE_STORE_PATH")
+
+    url_db_max_memory: Optional[str] = os.environ.get("TP_URL_DB_MAX_MEMORY")
+    url_db_max_memory: int = int(url_db_max_memory) if url_db_max_memory else 0
+
+    dedupe_hit_bonus: Optional[str] = os.environ.get("TP_DEDUPE_HIT_BONUS")
+    dedupe_hit_bonus: int = int(dedupe_hit_bonus) if dedupe_hit_bonus else 86400
+
     redis_host: str = os.environ.get("TP_REDIS_HOST")
     redis_host = redis_host if redis_host else "localhost"
 
@@ -124,4 +135,7 @@ def get_configuration() -> PublisherConfiguration:
         max_queue_len=max_queue_len,
         max_delay=max_delay,
         min_delay=min_delay,
+        image_store_path=image_store_path,
+        url_db_max_memory=url_db_max_memory,
+        dedupe_hit_bonus=dedupe_hit_bonus,
     )
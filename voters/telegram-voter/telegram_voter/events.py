@@ -15,8 +15,10 @@ class GotEvent:
         original_event: str = None,
         source: str = None,
         version: str = None,
+        digest: Optional[str] = None,
     ) -> None:
         self.tags: Optional[List[str]] = tags
+        self.digest: Optional[str] = digest
         self.version: Optional[List[str]] = version
         self.url: Optional[str] = url
         self.e_type: Optional[str] = e_type
@@ -38,6 +40,7 @@ class GotEvent:
             original_event=js,
             source=d["source"],
             version=d["version"],
+            digest=d.get("digest"),
         )
 
 
@@ -59,8 +62,13 @@ class GotRedditEvent(GotEvent):
         type: Optional[str] = None,
         original_event: Optional[str] = None,
         version: Optional[str] = None,
+        digest: Optional[str] = None,
+        **kwargs,
     ) -> None:
-        super().__init__(tags, url, type, original_event, source, version=version)
+        # Unknown fields from newer grabbers are ignored
+        super().__init__(
+            tags, url, type, original_event, source, version=version, digest=digest
+        )
         self.ups: Optional[int] = ups
         self.downs: Optional[int] = downs
         self.subreddit_name_prefixed: Optional[str] = subreddit_name_prefixed
@@ -91,9 +99,32 @@ class GotRedditEvent(GotEvent):
         return GotRedditEvent(**d)
 
 
+class GotRedditGalleryEvent(GotRedditEvent):
+    def __init__(
+        self,
+        urls: Optional[List[str]] = None,
+        digests: Optional[List[Optional[str]]] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        # `url` and `digest` are those of the first image
+        self.urls: List[str] = urls if urls else [self.url]
+        self.digests: List[Optional[str]] = (
+            digests if digests else [None] * len(self.urls)
+        )
+
+    @staticmethod
+    def from_dict(d: Dict) -> "GotRedditGalleryEvent":
+        js = json.dumps(d, separators=(",", ":"))
+        d["original_event"] = js
+        return GotRedditGalleryEvent(**d)
+
+
 def get_event_from_dict(d: Dict) -> GotEvent:
     if d["type"] == "Got_Reddit_Submission":
         return GotRedditEvent.from_dict(d)
+    elif d["type"] == "Got_Reddit_Gallery":
+        return GotRedditGalleryEvent.from_dict(d)
     else:
         return GotEvent.from_dict(d)
 
@@ -0,0 +1,98 @@
+import io
+import mmap
+from pathlib import Path
+from typing import List, Optional
+
+from aiogram.types import InputFile, InputMediaPhoto, MediaGroup
+
+# Telegram takes at most that many photos per album
+album_size = 10
+
+
+class MappedImage(io.RawIOBase):
+    """
+    Read-only file object over a memory-mapped image, so uploads read the page
+    cache directly instead of copying the whole image into the process first.
+    """
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        with open(path, "rb") as f:
+            self._map: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._map.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self) -> int:
+        return self._map.tell()
+
+    def close(self) -> None:
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+
+def image_path(root: str, digest: str) -> Path:
+    # Same layout as the grabber's image store
+    return Path(root) / digest[:2] / digest
+
+
+def get_stored_image(root: Optional[str], digest: Optional[str]) -> Optional[InputFile]:
+    """
+    Returns the stored image ready for upload, or `None` when there is no store
+    or the image was evicted, in which case the url has to be sent instead.
+    """
+    if not root or not digest:
+        return None
+
+    path = image_path(root, digest)
+    try:
+        image = MappedImage(path)
+        # Marks the image as recently used for the grabber's eviction
+        path.touch()
+    except (FileNotFoundError, ValueError):
+        return None
+
+    return InputFile(image, filename=digest)
+
+
+def get_albums(
+    root: Optional[str],
+    urls: List[str],
+    digests: List[Optional[str]],
+    caption: Optional[str],
+) -> List[MediaGroup]:
+    """
+    Splits the photos into albums Telegram accepts, uploading the stored ones.
+    The caption goes with the first photo, which is how Telegram shows it for
+    the whole album.
+    """
+    albums: List[MediaGroup] = []
+    for start in range(0, len(urls), album_size):
+        album = MediaGroup()
+        for url, digest in zip(
+            urls[start : start + album_size], digests[start : start + album_size]
+        ):
+            photo = get_stored_image(root, digest)
+            album.attach(
+                InputMediaPhoto(
+                    photo if photo is not None else url,
+                    caption=caption if not albums and not album.media else None,
+                    parse_mode="Markdown",
+                )
+            )
+        albums.append(album)
+
+    return albums
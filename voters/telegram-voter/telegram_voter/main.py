@@ -1,12 +1,17 @@
 import asyncio
-from typing import Dict
+from typing import Dict, Optional
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.types import Message
 from aiogram.utils import executor
 
-from telegram_voter.events import get_event_from_string
+from telegram_voter.events import (
+    GotEvent,
+    GotRedditGalleryEvent,
+    get_event_from_string,
+)
+from telegram_voter.image_store import get_albums, get_stored_image
 from telegram_voter.keyboards import (
     get_keyboard,
     up_code,
@@ -87,6 +92,36 @@ async def process_vote(callback_query, mid, res, v):
         await bot.answer_callback_query(callback_query.id, text="Unknown error")
 
 
+async def send_for_vote(event: GotEvent) -> Message:
+    caption = event.description if config.with_description else None
+
+    if isinstance(event, GotRedditGalleryEvent) and len(event.urls) > 1:
+        albums = get_albums(
+            config.image_store_path, event.urls, event.digests, caption
+        )
+        first: Optional[Message] = None
+        for album in albums:
+            sent = await bot.send_media_group(config.target_group, album)
+            first = first or sent[0]
+        # Albums can't carry a keyboard, so the vote goes in a reply
+        return await bot.send_message(
+            config.target_group,
+            f"🖼 {len(event.urls)}",
+            reply_to_message_id=first.message_id,
+            reply_markup=get_keyboard(),
+        )
+
+    # Uploading stored bytes spares Telegram fetching the url
+    photo = get_stored_image(config.image_store_path, event.digest)
+    return await bot.send_photo(
+        config.target_group,
+        photo if photo is not None else event.url,
+        caption=caption,
+        parse_mode="Markdown",
+        reply_markup=get_keyboard(),
+    )
+
+
 async def poll_for_memes():
     while True:
         vote_interval = 1 if config.vote_interval < 1 else config.vote_interval
@@ -97,15 +132,7 @@ async def poll_for_memes():
             if event_str:
                 try:
                     event = get_event_from_string(event_str)
-
-                    caption = event.description if config.with_description else None
-                    mess: Message = await bot.send_photo(
-                        config.target_group,
-                        event.url,
-                        caption=caption,
-                        parse_mode="Markdown",
-                        reply_markup=get_keyboard(),
-                    )
+                    mess: Message = await send_for_vote(event)
                     vote = Vote.from_got_event(
                         mess.message_id, config.vote_threshold, event
                     )
@@ -120,12 +147,13 @@ async def poll_for_memes():
 
 
 def grabber_handler(event: Dict) -> None:
-    push_gr_event(event["data"], config.tags)
+    # Tags were already matched by the channel pattern
+    push_gr_event(event["data"], [])
 
 
 if __name__ == "__main__":
     connect_to_redis(config)
-    gr_event_thread = subscribe_to_grabber_events(grabber_handler)
+    gr_event_thread = subscribe_to_grabber_events(grabber_handler, config.tags)
 
     dp.loop.create_task(poll_for_memes())
 
@@ -1,5 +1,6 @@
 from threading import Thread
 from typing import Optional, Callable, Union, Tuple, List
+from urllib.parse import quote
 
 import redis
 from redis import StrictRedis
@@ -10,6 +11,7 @@ from telegram_voter.utils import VoterConfiguration, get_current_utc_timestamp
 from telegram_voter.votes import Vote, VoteAttemptResult
 
 gr_events = "grabbers.events"
+gr_tag_events = "grabbers.events.tags"
 vt_events = "voters.events"
 
 votes_ttl: Optional[str] = None
@@ -158,8 +160,35 @@ def subscribe(channel: str, handler: Callable) -> Thread:
     return p.run_in_thread(sleep_time=0.001)
 
 
-def subscribe_to_grabber_events(handler: Callable) -> Thread:
-    return subscribe(gr_events, handler)
+def psubscribe(pattern: str, handler: Callable) -> Thread:
+    if not connection:
+        raise TelegramVoterException("There is no connection to redis")
+
+    p = connection.pubsub()
+    p.psubscribe(**{pattern: handler})
+
+    return p.run_in_thread(sleep_time=0.001)
+
+
+def tag_pattern(tags: List[str]) -> str:
+    # Grabbers publish to `grabbers.events.tags.<tag1><tag2>...` with tags sorted
+    # and quoted, so `*<a>*<b>*` matches events having both `a` and `b`
+    return (
+        f"{gr_tag_events}.*"
+        + "*".join(f"<{quote(tag, safe='')}>" for tag in sorted(set(tags)))
+        + "*"
+    )
+
+
+def subscribe_to_grabber_events(handler: Callable, tags: List[str]) -> Thread:
+    """
+    Subscribes to grabber events having all of `tags`. Events are filtered by
+    Redis, so they can be queued without being parsed.
+    """
+    if not tags:
+        return subscribe(gr_events, handler)
+
+    return psubscribe(tag_pattern(tags), handler)
 
 
 def push_gr_event(event: str, accepted_tags: List[str]) -> None:
@@ -34,6 +34,7 @@ class VoterConfiguration:
     vote_threshold: int
     vote_throttle: float
     vote_batch_size: int
+    image_store_path: Optional[str]
 
 
 def get_configuration() -> VoterConfiguration:
@@ -90,6 +91,8 @@ def get_configuration() -> VoterConfiguration:
     vote_batch_size: Optional[str] = os.environ.get("TV_BATCH_SIZE")
     vote_batch_size: int = int(vote_batch_size) if vote_batch_size else 5
 
+    image_store_path: Optional[str] = os.environ.get("TV_IMAGE_STORE_PATH")
+
     redis_host: str = os.environ.get("TV_REDIS_HOST")
     redis_host = redis_host if redis_host else "localhost"
 
@@ -118,4 +121,5 @@ def get_configuration() -> VoterConfiguration:
         vote_throttle=vote_throttle,
         vote_batch_size=vote_batch_size,
         with_description=with_description,
+        image_store_path=image_store_path,
     )